@@ -1,119 +1,261 @@
 from flask import Flask, request, redirect, url_for, session, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_bcrypt import Bcrypt
+from cachetools import TTLCache
+from werkzeug.security import check_password_hash
+from sqlalchemy import select, insert, bindparam, event, exists, func, distinct, case, cast, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import joinedload, selectinload, contains_eager, raiseload, make_transient_to_detached
 from datetime import datetime, timedelta
-import uuid
+from functools import lru_cache
+import itertools
+import os
+import secrets
+import threading
+import time
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'key123'
+# SQLite only: subject_stats (strftime), start_timer (sqlite insert) and the PRAGMA hook depend on it
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///study.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# pool_pre_ping/pool_recycle stay off: a local SQLite file never drops idle connections
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30}
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 31536000  # static assets are versioned in templates
 db = SQLAlchemy(app)
+bcrypt = Bcrypt(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# ---------------- SQLite tuning ----------------
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers run alongside the writer; NORMAL sync skips the fsync per commit
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA busy_timeout=5000')
+    cur.execute('PRAGMA cache_size=-32000')
+    # pages read through mmap sit in the OS page cache shared by every pooled connection
+    cur.execute('PRAGMA mmap_size=134217728')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
+
 # ---------------- Models ----------------
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), unique=True)
+    username = db.Column(db.String(50), unique=True, index=True)
     password = db.Column(db.String(100))
     theme = db.Column(db.String(10), default='light')  # 'light' or 'dark'
 
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    share_token = db.Column(db.String(64), unique=True, nullable=True)  # for read-only share
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    share_token = db.Column(db.String(24), unique=True, nullable=True)  # 22-char urlsafe token for read-only share (unique => indexed)
+    chapters = db.relationship('Chapter', backref='subject', lazy='select', order_by='Chapter.id')
 
 class Chapter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), index=True)
     last_studied = db.Column(db.DateTime, nullable=True)  # for revision schedule
+    topics = db.relationship('Topic', backref='chapter', lazy='select', order_by='Topic.id')
+    questions = db.relationship('Question', backref='chapter', lazy='select', order_by='Question.id')
 
 class Topic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), index=True)
     status = db.Column(db.String(20), default='not_started')  # not_started, in_progress, completed
     progress = db.Column(db.Integer, default=0)               # 0–100
     notes = db.Column(db.Text, default='')
+    # list views only need to know whether notes exist; they defer the TEXT itself
+    has_notes = db.column_property(func.coalesce(notes, '') != '')
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), index=True)
     text = db.Column(db.Text)
 
 class Flashcard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'))
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), index=True)
     front = db.Column(db.Text)  # question/formula name
     back = db.Column(db.Text)   # answer/formula
 
 class StudySession(db.Model):
+    __table_args__ = (
+        # user_id-led lookups (stats, running-timer list)
+        db.Index('ix_ss_running', 'user_id', 'subject_id', 'end_time'),
+        # at most one open timer per user and subject; start_timer relies on it for ON CONFLICT.
+        # Only backends with partial indexes get it: elsewhere the WHERE is dropped and the
+        # index would allow one session per subject, ever.
+        db.Index('ux_running_session', 'user_id', 'subject_id', unique=True,
+                 sqlite_where=db.text('end_time IS NULL'),
+                 postgresql_where=db.text('end_time IS NULL')).ddl_if(dialect=('sqlite', 'postgresql')),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=True)  # null while running
 
+# Display strings per Topic.status, looked up by the templates instead of branching per topic
+STATUS_ICON = {'not_started': '🔴', 'in_progress': '🟡', 'completed': '🟢'}
+STATUS_LABEL = {'not_started': 'Not Started', 'in_progress': 'In Progress', 'completed': 'Completed'}
+
+def ensure_indexes():
+    # create_all() only indexes tables it creates; add missing indexes to existing databases.
+    # Returns the names that could not be built (e.g. duplicate open timers block ux_running_session).
+    failed = []
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except DBAPIError as e:
+                app.logger.warning('index %s not created: %s', index.name, e.orig)
+                failed.append(index.name)
+    return failed
+
+@app.cli.command('init-db')
+def init_db():
+    """Create tables and indexes; run once per deploy instead of on every start."""
+    db.create_all()
+    ensure_indexes()
+
+@lru_cache(maxsize=1)
+def running_upsert():
+    # start_timer only takes the ON CONFLICT path when init-db has built the partial unique index;
+    # checked once per process on first use
+    return (db.engine.dialect.name == 'sqlite' and 'ux_running_session' in
+            {index['name'] for index in inspect(db.engine).get_indexes('study_session')})
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    uid = int(user_id)
+    with _cache_lock:
+        cols = _user_cache.get(uid)
+    if cols is None:
+        user = db.session.get(User, uid)
+        if user is not None:
+            with _cache_lock:
+                _user_cache[uid] = {c.key: getattr(user, c.key) for c in User.__table__.columns if c.key != 'password'}
+        return user
+    # rebuild from the cached row and attach it to this request's session without a SELECT
+    user = User(**cols)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+# Hot-path statements, built once so SQLAlchemy's compiled cache is reused across requests
+SUBJECTS_BY_USER = select(Subject).where(Subject.user_id == bindparam('uid')).options(selectinload(Subject.chapters))
+USER_BY_NAME = select(User).where(User.username == bindparam('u'))
+RUNNING_SUBJECT_IDS = select(StudySession.subject_id).where(
+    StudySession.user_id == bindparam('uid'), StudySession.end_time.is_(None))
+SHARED_SUBJECT = select(Subject.id, Subject.name).where(Subject.share_token == bindparam('token'))
+SHARED_PLAN = (
+    select(Chapter.id.label('chapter_id'), Chapter.name.label('chapter_name'),
+           Topic.name, Topic.status, Topic.progress)
+    .outerjoin(Topic, Topic.chapter_id == Chapter.id)
+    .where(Chapter.subject_id == bindparam('sid'))
+    .order_by(Chapter.id, Topic.id)
+)
+USERNAME_TAKEN = select(exists().where(User.username == bindparam('u')))
+
+# ---------------- Per-user caches ----------------
+# Home's subject list only changes through the routes below, which drop the entry on write
+_subj_cache = TTLCache(maxsize=10_000, ttl=300)
+_cache_lock = threading.Lock()
+
+def user_subjects(user_id):
+    with _cache_lock:
+        subjects = _subj_cache.get(user_id)
+    if subjects is None:
+        subjects = [{'id': s.id, 'name': s.name, 'share_token': s.share_token, 'chapter_count': len(s.chapters)}
+                    for s in db.session.scalars(SUBJECTS_BY_USER, {'uid': user_id})]
+        with _cache_lock:
+            _subj_cache[user_id] = subjects
+    return subjects
+
+def forget_subjects(user_id):
+    with _cache_lock:
+        _subj_cache.pop(user_id, None)
+
+# Dashboard aggregates from subject_stats; dropped by routes that change the counted rows
+_stats_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def user_stats(user_id):
+    with _cache_lock:
+        stats = _stats_cache.get(user_id)
+    if stats is None:
+        stats = subject_stats(user_id)
+        with _cache_lock:
+            _stats_cache[user_id] = stats
+    return stats
+
+def forget_stats(user_id):
+    with _cache_lock:
+        _stats_cache.pop(user_id, None)
+
+# Row snapshots for load_user (password excluded); dropped when the user row changes
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def forget_user(user_id):
+    with _cache_lock:
+        _user_cache.pop(user_id, None)
+
+# ---------------- Ownership lookups ----------------
+# One joined SELECT that both fetches the row and proves current_user owns it;
+# None covers missing and foreign rows alike, so other users' ids are not probed.
+def get_chapter_owned(chapter_id, user_id):
+    return (db.session.query(Chapter).join(Chapter.subject)
+            .filter(Chapter.id == chapter_id, Subject.user_id == user_id)
+            .options(contains_eager(Chapter.subject)).first())
+
+def get_topic_owned(topic_id, user_id):
+    return (db.session.query(Topic).join(Topic.chapter).join(Chapter.subject)
+            .filter(Topic.id == topic_id, Subject.user_id == user_id)
+            .options(contains_eager(Topic.chapter).contains_eager(Chapter.subject)).first())
 
 # ---------------- Theme helpers ----------------
-def theme_css(theme):
-    if theme == 'dark':
-        return {
-            'body_bg': '#1f1f1f',
-            'text': '#eaeaea',
-            'card_bg': '#2a2a2a',
-            'border': '#444',
-            'subject_bg': '#3a3a3a',
-            'subject_hover': '#333',
-            'link': '#66b2ff',
-            'accent': '#3498db',
-            'button_bg': '#27ae60',
-            'button_hover': '#229954',
-            'danger_bg': '#e74c3c',
-            'danger_hover': '#c0392b'
-        }
-    return {
-        'body_bg': '#f5f5f5',
-        'text': '#2c3e50',
-        'card_bg': '#ffffff',
-        'border': '#3498db',
-        'subject_bg': '#3498db',
-        'subject_hover': '#2980b9',
-        'link': '#008CBA',
-        'accent': '#3498db',
-        'button_bg': '#27ae60',
-        'button_hover': '#229954',
-        'danger_bg': '#e74c3c',
-        'danger_hover': '#c0392b'
-    }
+# Theme colours live in static/theme-{light,dark}.css so browsers cache them alongside app.css
+def theme_href(theme):
+    name = 'dark' if theme == 'dark' else 'light'
+    return url_for('static', filename=f'theme-{name}.css', v=app.jinja_env.globals['static_version'])
 
 # ---------------- Utility: stats & revision ----------------
 def subject_stats(user_id):
-    subjects = Subject.query.filter_by(user_id=user_id).all()
-    chapters = Chapter.query.join(Subject, Chapter.subject_id == Subject.id).filter(Subject.user_id == user_id).all()
-    topics = Topic.query.join(Chapter, Topic.chapter_id == Chapter.id).join(Subject, Chapter.subject_id == Subject.id).filter(Subject.user_id == user_id).all()
-    total_chapters = len(chapters)
-    total_topics = len(topics)
-    completed = sum(1 for t in topics if t.status == 'completed')
-    in_progress = sum(1 for t in topics if t.status == 'in_progress')
-    # Study hours
-    sessions = StudySession.query.filter_by(user_id=user_id).all()
-    minutes = 0
-    for s in sessions:
-        if s.end_time:
-            minutes += int((s.end_time - s.start_time).total_seconds() // 60)
+    # one row of aggregates instead of hydrating every subject, chapter and topic
+    subjects, chapters, topics, completed, in_progress = db.session.execute(
+        select(
+            func.count(distinct(Subject.id)),
+            func.count(distinct(Chapter.id)),
+            func.count(Topic.id),
+            func.coalesce(func.sum(case((Topic.status == 'completed', 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Topic.status == 'in_progress', 1), else_=0)), 0),
+        )
+        .select_from(Subject)
+        .outerjoin(Chapter, Chapter.subject_id == Subject.id)
+        .outerjoin(Topic, Topic.chapter_id == Chapter.id)
+        .where(Subject.user_id == user_id)
+    ).one()
+    # Study hours: whole minutes per finished session, summed (SQLite epoch seconds)
+    elapsed = (cast(func.strftime('%s', StudySession.end_time), db.Integer)
+               - cast(func.strftime('%s', StudySession.start_time), db.Integer))
+    minutes = db.session.scalar(
+        select(func.coalesce(func.sum(elapsed // 60), 0))
+        .where(StudySession.user_id == user_id, StudySession.end_time.isnot(None))
+    )
     return {
-        'subjects': len(subjects),
-        'chapters': total_chapters,
-        'topics': total_topics,
+        'subjects': subjects,
+        'chapters': chapters,
+        'topics': topics,
         'completed': completed,
         'in_progress': in_progress,
         'minutes': minutes
@@ -125,58 +267,304 @@ def revision_tip(chapter: Chapter):
         return f"You studied on {chapter.last_studied.strftime('%b %d')}. Revise on {next_rev.strftime('%b %d')} (7-day rule)."
     return "No study date yet. Update any topic to set last studied."
 
+# ---------------- Password hashing ----------------
+def _calibrate_rounds(target_ms, floor=10, ceiling=14):
+    # time one hash at the floor cost; every extra round doubles the work
+    start = time.perf_counter()
+    bcrypt.generate_password_hash('x' * 16, floor)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = floor
+    while rounds < ceiling and elapsed_ms * 2 <= target_ms:
+        elapsed_ms *= 2
+        rounds += 1
+    return rounds
+
+# Highest cost that keeps one hash under BCRYPT_TARGET_MS on this machine, unless pinned
+if os.environ.get('BCRYPT_LOG_ROUNDS'):
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ['BCRYPT_LOG_ROUNDS'])
+else:
+    app.config['BCRYPT_LOG_ROUNDS'] = _calibrate_rounds(int(os.environ.get('BCRYPT_TARGET_MS', 250)))
+
+def hash_password(password):
+    return bcrypt.generate_password_hash(password, app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+def verify_password(stored, password):
+    if stored.startswith('$2'):
+        return bcrypt.check_password_hash(stored, password)
+    # accounts registered before bcrypt still carry werkzeug pbkdf2/scrypt hashes
+    return check_password_hash(stored, password)
+
+def needs_rehash(stored):
+    # legacy werkzeug pbkdf2/scrypt hashes, or '$2b$<cost>$...' made before the calibrated cost went up
+    if not stored.startswith('$2'):
+        return True
+    return int(stored.split('$')[2]) < app.config['BCRYPT_LOG_ROUNDS']
+
+# Checked against when the username is unknown so both login paths cost one hash
+_DUMMY_HASH = hash_password('x' * 16)
+
+# ---------------- Page templates ----------------
+# Compiled once at import; views render these directly instead of building HTML per request.
+_TEMPLATE_SOURCES = {
+    'register': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <div class="auth">
+        <h2>Register</h2>
+        <form method="post">
+            Username: <input name="username" required><br>
+            Password: <input type="password" name="password" required><br>
+            <button class="register">Register</button>
+        </form>
+        <a href="/login">Have account? Login</a>
+    </div>
+    """,
+    'login': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <div class="auth">
+        <h2>Login</h2>
+        <form method="post">
+            Username: <input name="username" required><br>
+            Password: <input type="password" name="password" required><br>
+            <button>Login</button>
+        </form>
+        <a href="/register">Register</a>
+    </div>
+    """,
+    'subject_detail': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <div class="topbar">
+        <h2>{{ subject.name }}</h2>
+        <div>
+            <form method="post" action="/toggle_theme" style="display:inline;">
+                <button class="toggle" type="submit">Toggle: {{ user.theme.title() }} Mode</button>
+            </form>
+            <form method="post" action="/generate_share/{{ subject.id }}" style="display:inline;margin-left:8px;">
+                <button class="toggle" type="submit">Generate Share Link</button>
+            </form>
+        </div>
+    </div>
+    <div class="form">
+        <h3>Add Chapter</h3>
+        <form method="post">
+            Chapter Name: <input name="chapter_name" placeholder="Ch1 Kinetics...">
+            <button type="submit">Add Chapter</button>
+        </form>
+    </div>
+    <div class="filters">
+        <strong>Quick filter:</strong>
+        <a href="/subject/{{ subject.id }}">All</a>
+        <a href="/subject/{{ subject.id }}?status=not_started">🔴 Not Started</a>
+        <a href="/subject/{{ subject.id }}?status=in_progress">🟡 In Progress</a>
+        <a href="/subject/{{ subject.id }}?status=completed">🟢 Completed</a>
+    </div>
+    <h3>Chapters</h3>
+    <ul>
+    {% for row in chapters %}
+        {% set ch = row.chapter %}
+        <li><strong>{{ ch.name }}</strong>
+            <div class="rev"><em>Revision:</em> {{ row.tip }}</div>
+            <form method="post" action="/chapter/{{ ch.id }}/add_topic">
+                <input name="topic_name" placeholder="New topic..." required>
+                <select name="status">
+                    <option value="not_started">🔴 Not Started</option>
+                    <option value="in_progress">🟡 In Progress</option>
+                    <option value="completed">🟢 Completed</option>
+                </select>
+                <input type="number" name="progress" min="0" max="100" value="0">
+                <button type="submit">Add Topic</button>
+            </form>
+            <ul>
+            {% for t in row.topics %}
+                <li>{{ t.name }}{% if t.has_notes %} 📌{% endif %} - {{ STATUS_ICON.get(t.status, '🟢') }} {{ STATUS_LABEL.get(t.status) or t.status.replace('_', ' ').title() }} ({{ t.progress }}% understood)
+                    <form method="post" action="/topic/{{ t.id }}/update">
+                        <select name="status">
+                            <option value="not_started" {{ 'selected' if t.status == 'not_started' }}>🔴 Not Started</option>
+                            <option value="in_progress" {{ 'selected' if t.status == 'in_progress' }}>🟡 In Progress</option>
+                            <option value="completed" {{ 'selected' if t.status == 'completed' }}>🟢 Completed</option>
+                        </select>
+                        <input type="number" name="progress" min="0" max="100" value="{{ t.progress }}">
+                        <button type="submit">Update</button>
+                    </form>
+                    <a href="/topic/{{ t.id }}/notes">📝 Notes</a>
+                    <a href="/topic/{{ t.id }}/flashcards" style="margin-left:10px;">🔢 Flashcards</a>
+                </li>
+                {% if t.status == 'completed' and t.progress < 100 %}
+                <div class='tip'>Tip: Completed topics usually have 100% progress!</div>
+                {% endif %}
+            {% endfor %}
+            </ul>
+            <div class="summary"><em>Summary: {{ row.count }} topics, {{ row.completed }} completed, avg. {{ row.avg }}%</em></div>
+            <div class="questions">
+                <h4>Important Questions</h4>
+                <form method="post" action="/chapter/{{ ch.id }}/add_question">
+                    <input name="question_text" placeholder="Add important question..." style="width:70%;" required>
+                    <button type="submit">Add</button>
+                </form>
+            {% for q in row.questions %}
+                <div class='q-item'>Q: {{ q.text }}</div>
+            {% else %}
+                <div class='q-item'>No questions yet. Add common exam questions above.</div>
+            {% endfor %}
+            </div>
+        </li>
+    {% endfor %}
+    </ul>
+    <a href="/">Back to Subjects</a>
+    """,
+    'home': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <div class="container">
+        <div class="topbar">
+            <h1>📚 CBSE Study Planner - {{ user.username }}</h1>
+            <form method="post" action="/toggle_theme">
+                <button class="toggle" type="submit">Toggle: {{ user.theme.title() }} Mode</button>
+            </form>
+        </div>
+        <div class="subject-form">
+            <h3>Add Subject</h3>
+            <form method="post" action="/add_subject">
+                Subject Name: <input name="subject_name" placeholder="Physics, Chemistry, Maths..." required>
+                <button type="submit">Add Subject</button>
+            </form>
+        </div>
+        <div class="stats">
+            <h3>📊 Quick Stats</h3>
+            <div>📚 Total Chapters: {{ stats.chapters }}</div>
+            <div>✅ Completed Topics: {{ stats.completed }}</div>
+            <div>⏳ In Progress Topics: {{ stats.in_progress }}</div>
+            <div>📘 Total Topics: {{ stats.topics }}</div>
+            <div>⏱️ Study Hours: {{ stats.minutes // 60 }} hrs {{ stats.minutes % 60 }} min</div>
+        </div>
+        <h2>Your Subjects</h2>
+    {% for s, running in subjects %}
+        <div class="subject">
+            <a href="/subject/{{ s.id }}">{{ s.name }}</a>
+            <div class="meta">📚 {{ s.chapter_count }} chapters</div>
+            <div class="share">{% if s.share_token %}Share Link: /share/{{ s.share_token }} | PDF: /share_pdf/{{ s.share_token }}{% else %}No share link yet.{% endif %}</div>
+            <div class="timer">
+                <form method="post" action="/start_timer/{{ s.id }}" style="display:inline;">
+                    <button type="submit">▶ Start Timer</button>
+                </form>
+                <form method="post" action="/stop_timer/{{ s.id }}" style="display:inline;margin-left:6px;">
+                    <button type="submit">⏹ Stop Timer</button>
+                </form>
+                <span style="margin-left:8px;">Status: {{ 'Running' if running else 'Stopped' }}</span>
+            </div>
+        </div>
+    {% endfor %}
+        <br><a href="/logout"><button class="logout">Logout</button></a>
+    </div>
+    """,
+    'topic_notes': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <h2>Notes for: {{ topic.name }}</h2>
+    <div class="form notes">
+        <form method="post">
+            <textarea name="notes" placeholder="- Rate = change in conc/time&#10;- Units: mol/L/s&#10;- Formula: v = -d[A]/dt">{{ topic.notes or '' }}</textarea><br>
+            <button type="submit">Save Notes</button>
+        </form>
+    </div>
+    <a href="/subject/{{ subject.id }}">Back to Chapters</a>
+    """,
+    'topic_flashcards': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <h2>Flashcards for: {{ topic.name }}</h2>
+    <div class="form">
+        <h3>Create Flashcard</h3>
+        <form method="post">
+            <input name="front" placeholder="Front: e.g., Arrhenius Equation" required><br>
+            <textarea name="back" placeholder="Back: e.g., k = A·e^(-Ea/RT)" required></textarea><br>
+            <button type="submit">Add Flashcard</button>
+        </form>
+    </div>
+    <div class="flashcards">
+        <h3>Study Flashcards</h3>
+    {% for c in cards %}
+        <div class="fc-item"><div class="fc-front">Front: {{ c.front }}</div><div class="fc-back">Back: {{ c.back }}</div></div>
+    {% else %}
+        <div class="fc-item">No flashcards yet. Add some above.</div>
+    {% endfor %}
+    </div><br><a href="/subject/{{ subject.id }}">Back to Chapters</a>
+    """,
+    'share': """
+    <link rel="stylesheet" href="{{ url_for('static', filename='app.css', v=static_version) }}">
+    <link rel="stylesheet" href="{{ theme_href(theme) }}">
+    <div class="shared">
+        <h1>📤 Shared Study Plan (Read-only): {{ subject.name }}</h1>
+        <div class="card">
+            <p>This is a read-only view. Use your own app to edit.</p>
+        </div>
+        <h3>Chapters & Topics</h3>
+        <ul>
+        {% for ch in chapters %}
+            <li><strong>{{ ch.name }}</strong><ul>
+            {% for t in ch.topics %}
+                <li>{{ t.name }} — {{ STATUS_ICON.get(t.status, '🟢') }} {{ STATUS_LABEL.get(t.status) or t.status.replace('_', ' ').title() }} ({{ t.progress }}% understood)</li>
+            {% endfor %}
+            </ul></li>
+        {% endfor %}
+        </ul>
+    </div>
+    """,
+    'share_pdf': """
+    <h1>Study Plan: {{ subject.name }}</h1>
+    <hr>
+    {% for ch in chapters %}
+        <h2>Chapter: {{ ch.name }}</h2><ul>
+        {% for t in ch.topics %}<li>{{ t.name }} — {{ t.status }} — {{ t.progress }}%</li>{% endfor %}
+        </ul>
+    {% endfor %}
+    """,
+}
+_TEMPLATES = {name: app.jinja_env.from_string(src) for name, src in _TEMPLATE_SOURCES.items()}
+# Busts the year-long browser cache for the stylesheets whenever one of them changes
+app.jinja_env.globals['static_version'] = int(max(
+    os.path.getmtime(os.path.join(app.static_folder, name))
+    for name in ('app.css', 'theme-light.css', 'theme-dark.css')))
+app.jinja_env.globals['theme_href'] = theme_href
+app.jinja_env.globals.update(STATUS_ICON=STATUS_ICON, STATUS_LABEL=STATUS_LABEL)
+
+@app.after_request
+def cache_versioned_static(response):
+    # ?v= URLs change with the file, so the cached copy never needs revalidating
+    if request.endpoint == 'static' and 'v' in request.args:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
 # ---------------- Auth Routes ----------------
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
-        if User.query.filter_by(username=request.form['username']).first():
+        if db.session.scalar(USERNAME_TAKEN, {'u': request.form['username']}):
             return '<h2>User exists</h2><a href="/register">Back</a>'
         user = User(username=request.form['username'],
-                    password=generate_password_hash(request.form['password']))
+                    password=hash_password(request.form['password']))
         db.session.add(user)
         db.session.commit()
         return redirect(url_for('login'))
-    return '''
-    <style>
-        body { font-family: Arial; margin: 40px; background: #f0f0f0; }
-        h2 { color: #333; }
-        input { padding: 8px; margin: 5px 0; width: 220px; }
-        button { padding: 8px 15px; background: #4CAF50; color: white; border: none; cursor: pointer; }
-        a { color: #008CBA; text-decoration: none; }
-    </style>
-    <h2>Register</h2>
-    <form method="post">
-        Username: <input name="username" required><br>
-        Password: <input type="password" name="password" required><br>
-        <button>Register</button>
-    </form>
-    <a href="/login">Have account? Login</a>
-    '''
+    return _TEMPLATES['register'].render(theme='light')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        user = User.query.filter_by(username=request.form['username']).first()
-        if user and check_password_hash(user.password, request.form['password']):
+        user = db.session.scalars(USER_BY_NAME, {'u': request.form['username']}).first()
+        stored = user.password if user else _DUMMY_HASH
+        ok = verify_password(stored, request.form['password'])
+        if user and ok:
+            if needs_rehash(user.password):
+                user.password = hash_password(request.form['password'])
+                db.session.commit()
             login_user(user)
             return redirect(url_for('home'))
         return '<h2>Wrong info</h2><a href="/login">Back</a>'
-    return '''
-    <style>
-        body { font-family: Arial; margin: 40px; background: #f0f0f0; }
-        h2 { color: #333; }
-        input { padding: 8px; margin: 5px 0; width: 220px; }
-        button { padding: 8px 15px; background: #008CBA; color: white; border: none; cursor: pointer; }
-        a { color: #008CBA; text-decoration: none; }
-    </style>
-    <h2>Login</h2>
-    <form method="post">
-        Username: <input name="username" required><br>
-        Password: <input type="password" name="password" required><br>
-        <button>Login</button>
-    </form>
-    <a href="/register">Register</a>
-    '''
+    return _TEMPLATES['login'].render(theme='light')
 
 # ---------------- Theme toggle ----------------
 @app.route('/toggle_theme', methods=['POST'])
@@ -184,96 +572,85 @@ def login():
 def toggle_theme():
     current_user.theme = 'dark' if current_user.theme == 'light' else 'light'
     db.session.commit()
+    forget_user(current_user.id)
     return redirect(url_for('home'))
 
 # ---------------- Timer: start/stop ----------------
 @app.route('/start_timer/<int:subject_id>', methods=['POST'])
 @login_required
 def start_timer(subject_id):
-    subject = Subject.query.get(subject_id)
+    subject = db.session.get(Subject, subject_id)
     if not subject or subject.user_id != current_user.id:
         return 'Not authorized', 403
-    # If already running, ignore
-    running = StudySession.query.filter_by(user_id=current_user.id, subject_id=subject_id, end_time=None).first()
-    if not running:
-        sess = StudySession(subject_id=subject_id, user_id=current_user.id, start_time=datetime.now())
-        db.session.add(sess)
+    if running_upsert():
+        # If already running, the partial unique index turns the insert into a no-op
+        db.session.execute(
+            sqlite_insert(StudySession)
+            .values(subject_id=subject_id, user_id=current_user.id, start_time=datetime.now())
+            .on_conflict_do_nothing(index_elements=['user_id', 'subject_id'],
+                                    index_where=StudySession.end_time.is_(None)))
         db.session.commit()
+    elif not db.session.query(StudySession.query.filter_by(
+            user_id=current_user.id, subject_id=subject_id, end_time=None).exists()).scalar():
+        db.session.add(StudySession(subject_id=subject_id, user_id=current_user.id, start_time=datetime.now()))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # a concurrent click started it first
     return redirect(url_for('home'))
 
 @app.route('/stop_timer/<int:subject_id>', methods=['POST'])
 @login_required
 def stop_timer(subject_id):
-    subject = Subject.query.get(subject_id)
+    subject = db.session.get(Subject, subject_id)
     if not subject or subject.user_id != current_user.id:
         return 'Not authorized', 403
     running = StudySession.query.filter_by(user_id=current_user.id, subject_id=subject_id, end_time=None).first()
     if running:
         running.end_time = datetime.now()
         db.session.commit()
+        forget_stats(current_user.id)
     return redirect(url_for('home'))
 
 # ---------------- Share: generate token & read-only view ----------------
 @app.route('/generate_share/<int:subject_id>', methods=['POST'])
 @login_required
 def generate_share(subject_id):
-    subject = Subject.query.get(subject_id)
+    subject = db.session.get(Subject, subject_id)
     if not subject or subject.user_id != current_user.id:
         return 'Not authorized', 403
-    subject.share_token = uuid.uuid4().hex
+    subject.share_token = secrets.token_urlsafe(16)
     db.session.commit()
+    forget_subjects(current_user.id)
     return redirect(url_for('home'))
 
+def shared_plan(token):
+    # Read-only pages only need a few columns, so read plain rows instead of ORM objects
+    subject = db.session.execute(SHARED_SUBJECT, {'token': token}).first()
+    if subject is None:
+        return None, None
+    rows = db.session.execute(SHARED_PLAN, {'sid': subject.id})
+    chapters = []
+    for _, group in itertools.groupby(rows, key=lambda r: r.chapter_id):
+        group = list(group)
+        chapters.append({'name': group[0].chapter_name,
+                         'topics': [r for r in group if r.name is not None]})
+    return subject, chapters
+
 @app.route('/share/<token>')
 def share_view(token):
-    subject = Subject.query.filter_by(share_token=token).first()
+    subject, chapters = shared_plan(token)
     if not subject:
         return 'Invalid link', 404
-    chapters = Chapter.query.filter_by(subject_id=subject.id).all()
-    css = theme_css('light')
-    html = f'''
-    <style>
-        body {{ font-family: Arial; margin: 20px; background: {css['body_bg']}; color: {css['text']}; }}
-        h1 {{ color: {css['text']}; }}
-        .card {{ background: {css['card_bg']}; padding: 15px; margin: 10px 0; border: 2px solid {css['accent']}; border-radius: 5px; }}
-        ul {{ background: {css['card_bg']}; padding: 15px; border-radius: 5px; }}
-        li {{ padding: 6px; }}
-    </style>
-    <h1>📤 Shared Study Plan (Read-only): {subject.name}</h1>
-    <div class="card">
-        <p>This is a read-only view. Use your own app to edit.</p>
-    </div>
-    <h3>Chapters & Topics</h3>
-    <ul>
-    '''
-    for ch in chapters:
-        html += f'<li><strong>{ch.name}</strong><ul>'
-        topics = Topic.query.filter_by(chapter_id=ch.id).all()
-        for t in topics:
-            icon = '🔴' if t.status == 'not_started' else ('🟡' if t.status == 'in_progress' else '🟢')
-            html += f'<li>{t.name} — {icon} {t.status.replace("_"," ").title()} ({t.progress}% understood)</li>'
-        html += '</ul></li>'
-    html += '</ul>'
-    return html
+    return _TEMPLATES['share'].render(theme='light', subject=subject, chapters=chapters)
 
 @app.route('/share_pdf/<token>')
 def share_pdf(token):
-    subject = Subject.query.filter_by(share_token=token).first()
+    subject, chapters = shared_plan(token)
     if not subject:
         return 'Invalid link', 404
-    chapters = Chapter.query.filter_by(subject_id=subject.id).all()
     # Simple HTML -> PDF via browser print dialog (Content-Type hints)
-    html = f'''
-    <h1>Study Plan: {subject.name}</h1>
-    <hr>
-    '''
-    for ch in chapters:
-        html += f'<h2>Chapter: {ch.name}</h2><ul>'
-        topics = Topic.query.filter_by(chapter_id=ch.id).all()
-        for t in topics:
-            html += f'<li>{t.name} — {t.status} — {t.progress}%</li>'
-        html += '</ul>'
-    resp = make_response(html)
+    resp = make_response(_TEMPLATES['share_pdf'].render(subject=subject, chapters=chapters))
     resp.headers['Content-Type'] = 'text/html'
     # Users can Ctrl+P -> Save as PDF
     return resp
@@ -282,8 +659,16 @@ def share_pdf(token):
 @app.route('/subject/<int:subject_id>', methods=['GET', 'POST'])
 @login_required
 def subject_detail(subject_id):
-    subject = Subject.query.get(subject_id)
-    if not subject or subject.user_id != current_user.id:
+    chapters = joinedload(Subject.chapters)
+    topics = chapters.selectinload(Chapter.topics).defer(Topic.notes)
+    questions = chapters.selectinload(Chapter.questions)
+    loads = [topics, questions]
+    if app.debug:
+        # an unplanned lazy load (N+1) raises while developing instead of quietly querying per row
+        loads += [strategy.raiseload('*', sql_only=True) for strategy in (topics, questions)]
+        loads += [raiseload('*', sql_only=True), chapters.raiseload('*', sql_only=True)]
+    subject = Subject.query.options(*loads).filter_by(id=subject_id, user_id=current_user.id).first()
+    if subject is None:
         return 'Not found', 404
 
     if request.method == 'POST':
@@ -292,136 +677,46 @@ def subject_detail(subject_id):
             chapter = Chapter(name=chapter_name, subject_id=subject_id, last_studied=None)
             db.session.add(chapter)
             db.session.commit()
+            forget_subjects(current_user.id)
+            forget_stats(current_user.id)
         return redirect(url_for('subject_detail', subject_id=subject_id))
 
-    chapters = Chapter.query.filter_by(subject_id=subject_id).all()
     filter_status = request.args.get('status')
 
-    css = theme_css(current_user.theme)
-    html = f'''
-    <style>
-        body {{ font-family: Arial; margin: 20px; background: {css['body_bg']}; color: {css['text']}; }}
-        h2 {{ color: {css['text']}; }}
-        .form {{ background: {css['card_bg']}; padding: 15px; margin: 15px 0; border: 2px solid {css['border']}; border-radius: 5px; }}
-        input, button, select, textarea {{ padding: 8px; margin: 5px; }}
-        button {{ background: {css['button_bg']}; color: white; border: none; cursor: pointer; border-radius: 3px; }}
-        button:hover {{ background: {css['button_hover']}; }}
-        ul {{ background: {css['card_bg']}; padding: 15px; border-radius: 5px; }}
-        li {{ padding: 8px; margin: 5px 0; }}
-        a {{ color: {css['link']}; text-decoration: none; }}
-        .summary {{ margin-top: 8px; color: {css['text']}; }}
-        .tip {{ color: orange; margin-top: 4px; }}
-        .filters {{ margin: 10px 0; }}
-        .filters a {{ margin-right: 8px; }}
-        .topbar {{ display:flex; justify-content: space-between; align-items:center; }}
-        .toggle {{ background: {css['subject_bg']}; color: white; border:none; padding:6px 10px; border-radius:4px; cursor:pointer; }}
-        .toggle:hover {{ background: {css['subject_hover']}; }}
-        .questions {{ background: {css['card_bg']}; border: 2px solid {css['border']}; border-radius: 5px; padding: 12px; margin-top: 10px; }}
-        .q-item {{ background: #f9f9f9; color:#333; border: 1px solid #ddd; border-radius: 4px; padding: 8px; margin: 6px 0; }}
-        .rev {{ background: {css['card_bg']}; border: 2px solid {css['border']}; border-radius: 5px; padding: 12px; margin-top: 10px; }}
-    </style>
-    <div class="topbar">
-        <h2>{subject.name}</h2>
-        <div>
-            <form method="post" action="/toggle_theme" style="display:inline;">
-                <button class="toggle" type="submit">Toggle: {current_user.theme.title()} Mode</button>
-            </form>
-            <form method="post" action="/generate_share/{subject_id}" style="display:inline;margin-left:8px;">
-                <button class="toggle" type="submit">Generate Share Link</button>
-            </form>
-        </div>
-    </div>
-    <div class="form">
-        <h3>Add Chapter</h3>
-        <form method="post">
-            Chapter Name: <input name="chapter_name" placeholder="Ch1 Kinetics...">
-            <button type="submit">Add Chapter</button>
-        </form>
-    </div>
-    <div class="filters">
-        <strong>Quick filter:</strong>
-        <a href="/subject/{subject_id}">All</a>
-        <a href="/subject/{subject_id}?status=not_started">🔴 Not Started</a>
-        <a href="/subject/{subject_id}?status=in_progress">🟡 In Progress</a>
-        <a href="/subject/{subject_id}?status=completed">🟢 Completed</a>
-    </div>
-    <h3>Chapters</h3>
-    <ul>
-    '''
-    for ch in chapters:
-        topics = Topic.query.filter_by(chapter_id=ch.id).all()
+    # per-chapter summary (count, completed, avg progress) over the filtered topics, grouped in SQL
+    summary = select(
+        Topic.chapter_id,
+        func.count(Topic.id).label('n'),
+        func.sum(case((Topic.status == 'completed', 1), else_=0)).label('completed'),
+        func.avg(Topic.progress).label('avg'),
+    ).where(Topic.chapter_id.in_([ch.id for ch in subject.chapters])).group_by(Topic.chapter_id)
+    if filter_status:
+        summary = summary.where(Topic.status == filter_status)
+    agg = {r.chapter_id: r for r in db.session.execute(summary)}
+
+    rows = []
+    for ch in subject.chapters:
+        topics = ch.topics
         if filter_status:
             topics = [t for t in topics if t.status == filter_status]
-        html += f'''
-        <li><strong>{ch.name}</strong>
-            <div class="rev"><em>Revision:</em> {revision_tip(ch)}</div>
-            <form method="post" action="/chapter/{ch.id}/add_topic">
-                <input name="topic_name" placeholder="New topic..." required>
-                <select name="status">
-                    <option value="not_started">🔴 Not Started</option>
-                    <option value="in_progress">🟡 In Progress</option>
-                    <option value="completed">🟢 Completed</option>
-                </select>
-                <input type="number" name="progress" min="0" max="100" value="0">
-                <button type="submit">Add Topic</button>
-            </form>
-            <ul>
-        '''
-        total_progress, count, completed = 0, 0, 0
-        for t in topics:
-            icon = '🔴' if t.status == 'not_started' else ('🟡' if t.status == 'in_progress' else '🟢')
-            status_text = t.status.replace('_', ' ').title()
-            note_icon = ' 📌' if t.notes else ''
-            html += f'''
-                <li>{t.name}{note_icon} - {icon} {status_text} ({t.progress}% understood)
-                    <form method="post" action="/topic/{t.id}/update">
-                        <select name="status">
-                            <option value="not_started" {'selected' if t.status=='not_started' else ''}>🔴 Not Started</option>
-                            <option value="in_progress" {'selected' if t.status=='in_progress' else ''}>🟡 In Progress</option>
-                            <option value="completed" {'selected' if t.status=='completed' else ''}>🟢 Completed</option>
-                        </select>
-                        <input type="number" name="progress" min="0" max="100" value="{t.progress}">
-                        <button type="submit">Update</button>
-                    </form>
-                    <a href="/topic/{t.id}/notes">📝 Notes</a>
-                    <a href="/topic/{t.id}/flashcards" style="margin-left:10px;">🔢 Flashcards</a>
-                </li>
-            '''
-            if t.status == 'completed' and t.progress < 100:
-                html += "<div class='tip'>Tip: Completed topics usually have 100% progress!</div>"
-            total_progress += t.progress
-            count += 1
-            if t.status == 'completed':
-                completed += 1
-        avg = round(total_progress / count, 1) if count else 0
-        html += f'''
-            </ul>
-            <div class="summary"><em>Summary: {count} topics, {completed} completed, avg. {avg}%</em></div>
-            <div class="questions">
-                <h4>Important Questions</h4>
-                <form method="post" action="/chapter/{ch.id}/add_question">
-                    <input name="question_text" placeholder="Add important question..." style="width:70%;" required>
-                    <button type="submit">Add</button>
-                </form>
-        '''
-        questions = Question.query.filter_by(chapter_id=ch.id).all()
-        if not questions:
-            html += "<div class='q-item'>No questions yet. Add common exam questions above.</div>"
-        else:
-            for q in questions:
-                html += f"<div class='q-item'>Q: {q.text}</div>"
-        html += "</div></li>"
-    html += '''
-    </ul>
-    <a href="/">Back to Subjects</a>
-    '''
-    return html
+        a = agg.get(ch.id)
+        rows.append({
+            'chapter': ch,
+            'tip': revision_tip(ch),
+            'topics': topics,
+            'questions': ch.questions,
+            'count': a.n if a else 0,
+            'completed': a.completed if a else 0,
+            'avg': round(a.avg or 0, 1) if a else 0
+        })
+    return _TEMPLATES['subject_detail'].render(
+        theme=current_user.theme, user=current_user, subject=subject, chapters=rows)
 
 # ---------------- Add Topic ----------------
 @app.route('/chapter/<int:chapter_id>/add_topic', methods=['POST'])
 @login_required
 def add_topic(chapter_id):
-    chapter = Chapter.query.get(chapter_id)
+    chapter = get_chapter_owned(chapter_id, current_user.id)
     if not chapter:
         return 'Chapter not found', 404
     topic_name = request.form['topic_name']
@@ -437,13 +732,14 @@ def add_topic(chapter_id):
         # Set last studied when adding a topic
         chapter.last_studied = datetime.now()
         db.session.commit()
+        forget_stats(current_user.id)
     return redirect(url_for('subject_detail', subject_id=chapter.subject_id))
 
 # ---------------- Update Topic ----------------
 @app.route('/topic/<int:topic_id>/update', methods=['POST'])
 @login_required
 def update_topic(topic_id):
-    topic = Topic.query.get(topic_id)
+    topic = get_topic_owned(topic_id, current_user.id)
     if not topic:
         return 'Topic not found', 404
     topic.status = request.form.get('status', topic.status)
@@ -453,23 +749,21 @@ def update_topic(topic_id):
         pass
     topic.progress = max(0, min(topic.progress, 100))
     # Update chapter last studied on any topic change
-    chapter = Chapter.query.get(topic.chapter_id)
-    if chapter:
-        chapter.last_studied = datetime.now()
+    chapter = topic.chapter
+    chapter.last_studied = datetime.now()
     db.session.commit()
+    forget_stats(current_user.id)
     return redirect(url_for('subject_detail', subject_id=chapter.subject_id))
 
 # ---------------- Topic Notes ----------------
 @app.route('/topic/<int:topic_id>/notes', methods=['GET', 'POST'])
 @login_required
 def topic_notes(topic_id):
-    topic = Topic.query.get(topic_id)
+    topic = get_topic_owned(topic_id, current_user.id)
     if not topic:
         return 'Topic not found', 404
-    chapter = Chapter.query.get(topic.chapter_id)
-    subject = Subject.query.get(chapter.subject_id) if chapter else None
-    if not subject or subject.user_id != current_user.id:
-        return 'Not authorized', 403
+    chapter = topic.chapter
+    subject = chapter.subject
 
     if request.method == 'POST':
         topic.notes = request.form.get('notes', '')
@@ -478,93 +772,41 @@ def topic_notes(topic_id):
         db.session.commit()
         return redirect(url_for('subject_detail', subject_id=subject.id))
 
-    css = theme_css(current_user.theme)
-    return f'''
-    <style>
-        body {{ font-family: Arial; margin: 20px; background: {css['body_bg']}; color: {css['text']}; }}
-        h2 {{ color: {css['text']}; }}
-        .form {{ background: {css['card_bg']}; padding: 15px; margin: 15px 0; border: 2px solid {css['border']}; border-radius: 5px; }}
-        textarea {{ width: 100%; height: 220px; padding: 8px; }}
-        button {{ background: {css['button_bg']}; color: white; border: none; cursor: pointer; border-radius: 3px; padding: 8px 15px; }}
-        a {{ color: {css['link']}; text-decoration: none; }}
-    </style>
-    <h2>Notes for: {topic.name}</h2>
-    <div class="form">
-        <form method="post">
-            <textarea name="notes" placeholder="- Rate = change in conc/time&#10;- Units: mol/L/s&#10;- Formula: v = -d[A]/dt">{topic.notes or ''}</textarea><br>
-            <button type="submit">Save Notes</button>
-        </form>
-    </div>
-    <a href="/subject/{subject.id}">Back to Chapters</a>
-    '''
+    return _TEMPLATES['topic_notes'].render(theme=current_user.theme, topic=topic, subject=subject)
 
 # ---------------- Flashcards ----------------
 @app.route('/topic/<int:topic_id>/flashcards', methods=['GET', 'POST'])
 @login_required
 def topic_flashcards(topic_id):
-    topic = Topic.query.get(topic_id)
+    topic = get_topic_owned(topic_id, current_user.id)
     if not topic:
         return 'Topic not found', 404
-    chapter = Chapter.query.get(topic.chapter_id)
-    subject = Subject.query.get(chapter.subject_id) if chapter else None
-    if not subject or subject.user_id != current_user.id:
-        return 'Not authorized', 403
+    chapter = topic.chapter
+    subject = chapter.subject
 
     if request.method == 'POST':
-        front = request.form.get('front', '').strip()
-        back = request.form.get('back', '').strip()
-        if front and back:
-            fc = Flashcard(topic_id=topic_id, front=front, back=back)
-            db.session.add(fc)
+        # the form may repeat front/back pairs; all cards go in with one INSERT
+        cards = [{'topic_id': topic_id, 'front': front.strip(), 'back': back.strip()}
+                 for front, back in zip(request.form.getlist('front'), request.form.getlist('back'))
+                 if front.strip() and back.strip()]
+        if cards:
+            db.session.execute(insert(Flashcard), cards)
             # flashcard creation counts as study activity
             chapter.last_studied = datetime.now()
             db.session.commit()
         return redirect(url_for('topic_flashcards', topic_id=topic_id))
 
     cards = Flashcard.query.filter_by(topic_id=topic_id).all()
-    css = theme_css(current_user.theme)
-    html = f'''
-    <style>
-        body {{ font-family: Arial; margin: 20px; background: {css['body_bg']}; color: {css['text']}; }}
-        h2 {{ color: {css['text']}; }}
-        .form {{ background: {css['card_bg']}; padding: 15px; margin: 15px 0; border: 2px solid {css['border']}; border-radius: 5px; }}
-        input, textarea, button {{ padding: 8px; margin: 5px; }}
-        button {{ background: {css['button_bg']}; color: white; border: none; cursor: pointer; border-radius: 3px; padding: 8px 15px; }}
-        a {{ color: {css['link']}; text-decoration: none; }}
-        .flashcards {{ background: {css['card_bg']}; border: 2px solid {css['border']}; border-radius: 5px; padding: 12px; margin-top: 10px; }}
-        .fc-item {{ background: #f9f9f9; color:#333; border: 1px solid #ddd; border-radius: 4px; padding: 8px; margin: 6px 0; }}
-        .fc-front {{ font-weight: bold; }}
-    </style>
-    <h2>Flashcards for: {topic.name}</h2>
-    <div class="form">
-        <h3>Create Flashcard</h3>
-        <form method="post">
-            <input name="front" placeholder="Front: e.g., Arrhenius Equation" required><br>
-            <textarea name="back" placeholder="Back: e.g., k = A·e^(-Ea/RT)" required></textarea><br>
-            <button type="submit">Add Flashcard</button>
-        </form>
-    </div>
-    <div class="flashcards">
-        <h3>Study Flashcards</h3>
-    '''
-    if not cards:
-        html += '<div class="fc-item">No flashcards yet. Add some above.</div>'
-    else:
-        for c in cards:
-            html += f'<div class="fc-item"><div class="fc-front">Front: {c.front}</div><div class="fc-back">Back: {c.back}</div></div>'
-    html += f'</div><br><a href="/subject/{subject.id}">Back to Chapters</a>'
-    return html
+    return _TEMPLATES['topic_flashcards'].render(theme=current_user.theme, topic=topic, subject=subject, cards=cards)
 
 # ---------------- Add Question ----------------
 @app.route('/chapter/<int:chapter_id>/add_question', methods=['POST'])
 @login_required
 def add_question(chapter_id):
-    chapter = Chapter.query.get(chapter_id)
+    chapter = get_chapter_owned(chapter_id, current_user.id)
     if not chapter:
         return 'Chapter not found', 404
-    subject = Subject.query.get(chapter.subject_id)
-    if not subject or subject.user_id != current_user.id:
-        return 'Not authorized', 403
+    subject = chapter.subject
     text = request.form.get('question_text', '').strip()
     if text:
         q = Question(chapter_id=chapter_id, text=text)
@@ -583,97 +825,32 @@ def add_subject():
         subject = Subject(name=name, user_id=current_user.id)
         db.session.add(subject)
         db.session.commit()
+        forget_subjects(current_user.id)
+        forget_stats(current_user.id)
     return redirect(url_for('home'))
 
 # ---------------- Home + Quick Stats ----------------
 @app.route('/')
 @login_required
 def home():
-    subjects = Subject.query.filter_by(user_id=current_user.id).all()
-    css = theme_css(current_user.theme)
-    stats = subject_stats(current_user.id)
-    html = f'''
-    <style>
-        body {{ font-family: Arial; margin: 20px; background: {css['body_bg']}; color: {css['text']}; }}
-        h1 {{ color: {css['text']}; text-align: center; }}
-        .container {{ max-width: 1000px; margin: 0 auto; }}
-        .subject {{ background: {css['subject_bg']}; color: white; padding: 15px; margin: 10px 0; border-radius: 5px; cursor: pointer; }}
-        .subject:hover {{ background: {css['subject_hover']}; }}
-        .subject a {{ color: white; text-decoration: none; display: block; }}
-        .subject-form {{ background: {css['card_bg']}; padding: 15px; margin: 20px 0; border: 2px solid {css['accent']}; border-radius: 5px; }}
-        input, button {{ padding: 8px; margin: 5px; }}
-        button {{ background: {css['button_bg']}; color: white; border: none; cursor: pointer; border-radius: 3px; }}
-        button:hover {{ background: {css['button_hover']}; }}
-        .logout {{ background: {css['danger_bg']}; color: white; padding: 8px 15px; border: none; border-radius: 3px; cursor: pointer; }}
-        .logout:hover {{ background: {css['danger_hover']}; }}
-        .topbar {{ display:flex; justify-content: space-between; align-items:center; }}
-        .toggle {{ background: {css['subject_bg']}; color: white; border:none; padding:6px 10px; border-radius:4px; cursor:pointer; }}
-        .toggle:hover {{ background: {css['subject_hover']}; }}
-        .stats {{ background: {css['card_bg']}; padding: 15px; border: 2px solid {css['accent']}; border-radius: 5px; margin-top: 10px; }}
-        .share {{ font-size: 0.9em; margin-top: 6px; }}
-        .timer {{ margin-top: 6px; }}
-    </style>
-    <div class="container">
-        <div class="topbar">
-            <h1>📚 CBSE Study Planner - {current_user.username}</h1>
-            <form method="post" action="/toggle_theme">
-                <button class="toggle" type="submit">Toggle: {current_user.theme.title()} Mode</button>
-            </form>
-        </div>
-        <div class="subject-form">
-            <h3>Add Subject</h3>
-            <form method="post" action="/add_subject">
-                Subject Name: <input name="subject_name" placeholder="Physics, Chemistry, Maths..." required>
-                <button type="submit">Add Subject</button>
-            </form>
-        </div>
-        <div class="stats">
-            <h3>📊 Quick Stats</h3>
-            <div>📚 Total Chapters: {stats['chapters']}</div>
-            <div>✅ Completed Topics: {stats['completed']}</div>
-            <div>⏳ In Progress Topics: {stats['in_progress']}</div>
-            <div>📘 Total Topics: {stats['topics']}</div>
-            <div>⏱️ Study Hours: {stats['minutes'] // 60} hrs {stats['minutes'] % 60} min</div>
-        </div>
-        <h2>Your Subjects</h2>
-    '''
-    for subject in subjects:
-        share_info = f"Share Link: /share/{subject.share_token} | PDF: /share_pdf/{subject.share_token}" if subject.share_token else "No share link yet."
-        # Timer controls
-        running = StudySession.query.filter_by(user_id=current_user.id, subject_id=subject.id, end_time=None).first()
-        timer_controls = f'''
-            <div class="timer">
-                <form method="post" action="/start_timer/{subject.id}" style="display:inline;">
-                    <button type="submit">▶ Start Timer</button>
-                </form>
-                <form method="post" action="/stop_timer/{subject.id}" style="display:inline;margin-left:6px;">
-                    <button type="submit">⏹ Stop Timer</button>
-                </form>
-                <span style="margin-left:8px;">Status: {'Running' if running else 'Stopped'}</span>
-            </div>
-        '''
-        html += f'''
-        <div class="subject">
-            <a href="/subject/{subject.id}">{subject.name}</a>
-            <div class="share">{share_info}</div>
-            {timer_controls}
-        </div>
-        '''
-    html += '''
-        <br><a href="/logout"><button class="logout">Logout</button></a>
-    </div>
-    '''
-    return html
+    running_ids = set(db.session.scalars(RUNNING_SUBJECT_IDS, {'uid': current_user.id}))
+    rows = [(subject, subject['id'] in running_ids) for subject in user_subjects(current_user.id)]
+    return _TEMPLATES['home'].render(
+        theme=current_user.theme, user=current_user, stats=user_stats(current_user.id), subjects=rows)
 
 # ---------------- Logout ----------------
 @app.route('/logout')
 @login_required
 def logout():
+    forget_user(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
 # ---------------- Run App ----------------
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    if os.environ.get('INIT_DB'):
+        with app.app_context():
+            db.create_all()
+            ensure_indexes()
+    # Werkzeug dev server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=bool(os.environ.get('FLASK_DEV')))
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+
+# Caches in app.py (subjects, users) live per process and are only invalidated
+# locally, so scale with threads first and add workers via WEB_CONCURRENCY.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+keepalive = 5
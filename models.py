@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import event, select
 
 db = SQLAlchemy()
 
@@ -11,107 +12,187 @@ class User(UserMixin, db.Model):
     theme = db.Column(db.String(10), default='light')  # 'light' or 'dark'
     
     # Gamification fields
-    points = db.Column(db.Integer, default=0)
+    points = db.Column(db.Integer, default=0, index=True)  # leaderboard ORDER BY points DESC LIMIT n
     streak = db.Column(db.Integer, default=0)
     level = db.Column(db.Integer, default=0, index=True)  # Add index for leaderboard
     last_study_date = db.Column(db.DateTime, index=True)  # Add index for streak calculations
+    # Running totals over finished StudySessions, kept in step by utils.finish_session
+    total_study_minutes = db.Column(db.Integer, default=0, nullable=False, index=True)
+    session_count = db.Column(db.Integer, default=0, nullable=False)
     
     # Relationships
-    subjects = db.relationship('Subject', backref='user', lazy=True, cascade='all, delete-orphan')
-    badges = db.relationship('Badge', backref='user', lazy=True, cascade='all, delete-orphan')
-    reminders = db.relationship('Reminder', backref='user', lazy=True, cascade='all, delete-orphan')
-    achievements = db.relationship('Achievement', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Lazy by default; list views opt into selectinload() for the paths they render
+    subjects = db.relationship('Subject', back_populates='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    badges = db.relationship('Badge', back_populates='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    reminders = db.relationship('Reminder', back_populates='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    achievements = db.relationship('Achievement', back_populates='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class Subject(db.Model):
+    # Subject pickers list a user's subjects by name/color only; the index answers them without the table
+    __table_args__ = (
+        db.Index('ix_subject_user_cover', 'user_id', 'name', 'color'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # Add index
-    share_token = db.Column(db.String(64), unique=True, nullable=True, index=True)  # Add index for sharing
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    share_token = db.Column(db.BigInteger, unique=True, nullable=True, index=True)  # random 63-bit id, base62 in share URLs
     color = db.Column(db.String(7), default='#3498db')  # hex color code
     
     # Relationships
-    chapters = db.relationship('Chapter', backref='subject', lazy=True, cascade='all, delete-orphan')
-    study_sessions = db.relationship('StudySession', backref='subject', lazy=True, cascade='all, delete-orphan')
+    user = db.relationship('User', back_populates='subjects')
+    chapters = db.relationship('Chapter', backref='subject', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    study_sessions = db.relationship('StudySession', backref='subject', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class Chapter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), index=True)
     last_studied = db.Column(db.DateTime, nullable=True)  # for revision schedule
+    progress_pct = db.Column(db.Integer, default=0)  # average Topic.progress, kept by utils.refresh_chapter_progress
     
     # Relationships
-    topics = db.relationship('Topic', backref='chapter', lazy=True, cascade='all, delete-orphan')
-    questions = db.relationship('Question', backref='chapter', lazy=True, cascade='all, delete-orphan')
+    topics = db.relationship('Topic', backref='chapter', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    questions = db.relationship('Question', backref='chapter', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class Topic(db.Model):
+    # Per-user topic counts filter user -> status straight from the index, no chapter/subject join
+    __table_args__ = (
+        db.Index('ix_topic_user_status', 'user_id', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), index=True)
+    # Owner, copied from chapter.subject.user_id on insert (see the before_insert listeners below)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     status = db.Column(db.String(20), default='not_started', index=True)  # Add index for filtering
     progress = db.Column(db.Integer, default=0)               # 0-100
-    notes = db.Column(db.Text, default='')
+    # Deferred: topic lists only show name/status; load with undefer() where the text is needed
+    notes = db.deferred(db.Column(db.Text, default=''))
     
     # Relationships
-    flashcards = db.relationship('Flashcard', backref='topic', lazy=True, cascade='all, delete-orphan')
+    flashcards = db.relationship('Flashcard', backref='topic', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'))
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), index=True)
     text = db.Column(db.Text)
     difficulty = db.Column(db.String(20), default='medium')  # easy, medium, hard
 
 class Flashcard(db.Model):
+    # Due-card lookups go user -> next_review; cards that were never scheduled stay out of the index
+    __table_args__ = (
+        db.Index('ix_flashcard_due', 'user_id', 'next_review',
+                 sqlite_where=db.text('next_review IS NOT NULL'),
+                 postgresql_where=db.text('next_review IS NOT NULL')),
+        db.Index('ix_flashcard_user_mastery', 'user_id', 'mastery_level'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'))
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id', ondelete='CASCADE'), index=True)
+    # Owner, copied from topic.user_id on insert (see the before_insert listeners below)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     front = db.Column(db.Text)  # question/formula name
-    back = db.Column(db.Text)   # answer/formula
-    next_review = db.Column(db.DateTime, nullable=True, index=True)  # Add index for spaced repetition
+    # Deferred: due-card lists only show the front; load with undefer() where answers are shown
+    back = db.deferred(db.Column(db.Text))   # answer/formula
+    next_review = db.Column(db.DateTime, nullable=True)
     review_count = db.Column(db.Integer, default=0)
     mastery_level = db.Column(db.Integer, default=0, index=True)  # Add index for filtering by mastery
 
 class StudySession(db.Model):
+    # Sessions are read per user: recent/last-30-days by start_time, running ones by end_time;
+    # per subject: the subject's running timer and Subject.study_sessions loads
+    __table_args__ = (
+        db.Index('ix_study_session_user_start', 'user_id', 'start_time'),
+        db.Index('ix_study_session_user_end', 'user_id', 'end_time'),
+        db.Index('ix_study_session_subject_user_end', 'subject_id', 'user_id', 'end_time'),
+    )
+    # Fetch duration_minutes back (RETURNING) when end_time is written
+    __mapper_args__ = {'eager_defaults': True}
+
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # Add index
-    start_time = db.Column(db.DateTime, nullable=False, index=True)  # Add index for time-based queries
-    end_time = db.Column(db.DateTime, nullable=True, index=True)  # Add index
-    duration_minutes = db.Column(db.Integer, default=0)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=True)
+    # Whole minutes between start and end, computed by the database; 0 while the session is running
+    duration_minutes = db.Column(db.Integer, db.Computed(
+        "CASE WHEN end_time IS NULL THEN 0 "
+        "ELSE (CAST(strftime('%s', end_time) AS INTEGER) - CAST(strftime('%s', start_time) AS INTEGER)) / 60 END",
+        persisted=True))
     notes = db.Column(db.Text, default='')
 
 class Reminder(db.Model):
+    # Covers the dashboard's "my upcoming reminders" (user, not completed, ordered by time)
+    __table_args__ = (
+        db.Index('ix_reminder_user_open_time', 'user_id', 'is_completed', 'reminder_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # Add index
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=True)
-    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='SET NULL'), nullable=True)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id', ondelete='SET NULL'), nullable=True)
     title = db.Column(db.String(200))
     description = db.Column(db.Text, default='')
     reminder_time = db.Column(db.DateTime, nullable=False, index=True)  # Add index for time-based queries
-    is_completed = db.Column(db.Boolean, default=False, index=True)  # Add index
+    is_completed = db.Column(db.Boolean, default=False)
     repeat = db.Column(db.String(20), default='once')  # once, daily, weekly, monthly
 
+    user = db.relationship('User', back_populates='reminders')
+
 class Badge(db.Model):
+    # A user's badges are listed newest first (achievements page, leaderboard)
+    __table_args__ = (
+        db.Index('ix_badge_user_earned', 'user_id', 'earned_at'),
+        # each badge is earned once; an index (not a table constraint) so ensure_indexes can add it to old tables
+        db.Index('uq_badge_user_name', 'user_id', 'name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     name = db.Column(db.String(100))
     description = db.Column(db.Text)
     icon = db.Column(db.String(50))  # emoji or icon code
     earned_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    user = db.relationship('User', back_populates='badges')
+
 class Achievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     type = db.Column(db.String(50))  # topics_completed, study_time, flashcards_mastered, etc.
     value = db.Column(db.Integer)
     description = db.Column(db.Text)
     achieved_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    user = db.relationship('User', back_populates='achievements')
+
 class StudyEvent(db.Model):
+    # The calendar reads one user's events for a date range
+    __table_args__ = (
+        db.Index('ix_study_event_user_date', 'user_id', 'event_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)  # Add index
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'))
     title = db.Column(db.String(200))
     description = db.Column(db.Text, default='')
-    event_date = db.Column(db.Date, nullable=False, index=True)  # Add index for calendar queries
+    event_date = db.Column(db.Date, nullable=False)
     start_time = db.Column(db.Time, nullable=True)
     end_time = db.Column(db.Time, nullable=True)
-    event_type = db.Column(db.String(50), default='study')  # study, exam, revision, etc.
\ No newline at end of file
+    event_type = db.Column(db.String(50), default='study')  # study, exam, revision, etc.
+
+# Topic/Flashcard.user_id lets per-user queries skip the topic -> chapter -> subject join.
+# Views set it directly; this covers ORM inserts that leave it out.
+@event.listens_for(Topic, 'before_insert')
+def _fill_topic_owner(mapper, connection, target):
+    if target.user_id is None:
+        target.user_id = connection.scalar(
+            select(Subject.user_id).join(Chapter).where(Chapter.id == target.chapter_id))
+
+@event.listens_for(Flashcard, 'before_insert')
+def _fill_flashcard_owner(mapper, connection, target):
+    if target.user_id is None:
+        target.user_id = connection.scalar(select(Topic.user_id).where(Topic.id == target.topic_id))
@@ -1,20 +1,50 @@
-from flask import Flask, request, redirect, url_for, session, make_response, render_template, jsonify
+from flask import Flask, request, redirect, url_for, session, make_response, render_template, jsonify, abort, Response, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-import uuid
+import os
+import threading
+import click
+from functools import lru_cache
 import json
 from io import BytesIO
 
 from models import db, User, Subject, Chapter, Topic, Question, Flashcard, StudySession, Reminder, Badge, Achievement, StudyEvent
-from utils import subject_stats, revision_tip, update_user_points, update_streak, grant_badge, check_achievements, get_user_achievements, update_flashcard_mastery, get_due_flashcards, export_user_data, theme_css
+from utils import user_stats, forget_stats, revision_tip, update_user_points, update_streak, finish_session, grant_badge, check_achievements, get_user_achievements, update_flashcard_mastery, get_due_flashcards, export_user_data, theme_css, leaderboard_snapshot, new_share_token, stored_share_token, share_url_token, parse_share_url_token, expire_streaks, add_missing_columns, rebuild_study_sessions, ensure_indexes, backfill_owner_ids, backfill_study_totals, backfill_chapter_progress, refresh_chapter_progress, next_occurrence
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from cachetools import TTLCache
+from sqlalchemy import event, select, insert, func, case
+from sqlalchemy.orm import selectinload, undefer, load_only, contains_eager
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'key123'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///study.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# pool_pre_ping/pool_recycle stay off: a local SQLite file never drops idle connections.
+# A larger compiled-statement cache keeps the ORM's hot queries from being recompiled.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 20, 'max_overflow': 10, 'pool_timeout': 30, 'query_cache_size': 1200}
+# Local dev convenience: create missing tables on import; deploys run `flask --app routes init-db`
+app.config['AUTO_CREATE_ALL'] = bool(os.environ.get('AUTO_CREATE_ALL'))
+# Load WeasyPrint and build its font config at startup; DISABLE_PDF=1 skips it (tests, workers without PDFs)
+app.config['PRELOAD_PDF'] = os.environ.get('DISABLE_PDF') != '1'
 db.init_app(app)
 
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers run alongside the writer; NORMAL sync skips the fsync per commit
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA busy_timeout=5000')
+    cur.execute('PRAGMA cache_size=-32000')
+    cur.execute('PRAGMA mmap_size=134217728')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+    cur.execute('PRAGMA foreign_keys=ON')
+    cur.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -23,6 +53,28 @@ login_manager.login_view = 'login'
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# ---------------- Ownership lookups ----------------
+# One joined SELECT that both fetches the row and proves the user owns it;
+# missing and foreign rows alike 404, so other users' ids are not probed.
+def get_chapter_owned(chapter_id, user_id):
+    return (Chapter.query.join(Chapter.subject)
+            .filter(Chapter.id == chapter_id, Subject.user_id == user_id)
+            .options(contains_eager(Chapter.subject)).first_or_404())
+
+def get_topic_owned(topic_id, user_id, *options):
+    return (Topic.query.join(Topic.chapter).join(Chapter.subject)
+            .filter(Topic.id == topic_id, Subject.user_id == user_id)
+            .options(contains_eager(Topic.chapter).contains_eager(Chapter.subject), *options).first_or_404())
+
+# ---------------- Action responses ----------------
+def action_done(endpoint, extra=None, **values):
+    """Finish a POST action: JSON clients get the user's totals, browsers the usual redirect"""
+    # Scripts that ask for JSON update the page in place, skipping the redirect's full re-render
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(ok=True, points=current_user.points, level=current_user.level,
+                       streak=current_user.streak, **(extra or {}))
+    return redirect(url_for(endpoint, **values))
+
 # ---------------- Authentication Routes ----------------
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -38,10 +90,11 @@ def register():
         new_user = User(username=username, password=hashed_password)
         
         db.session.add(new_user)
-        db.session.commit()
+        db.session.flush()  # assigns new_user.id for the badge row
         
         # Grant welcome badge
         grant_badge(new_user, 'welcome', 'Welcome to CBSE Study Planner!')
+        db.session.commit()
         
         return redirect(url_for('login'))
     
@@ -76,7 +129,7 @@ def logout():
 def toggle_theme():
     current_user.theme = 'dark' if current_user.theme == 'light' else 'light'
     db.session.commit()
-    return redirect(url_for('home'))
+    return action_done('home', {'theme': current_user.theme})
 
 # ---------------- Timer Routes ----------------
 
@@ -89,15 +142,13 @@ def start_timer(subject_id):
         return 'Unauthorized', 403
     
     # Stop any running session for this user
-    running_session = StudySession.query.filter_by(
+    running_id = db.session.scalar(select(StudySession.id).filter_by(
         user_id=current_user.id,
         end_time=None
-    ).first()
+    ).limit(1))
     
-    if running_session:
-        running_session.end_time = datetime.utcnow()
-        running_session.duration_minutes = int((running_session.end_time - running_session.start_time).total_seconds() / 60)
-        db.session.commit()
+    if running_id:
+        finish_session(current_user, running_id)
     
     # Start new session
     new_session = StudySession(
@@ -107,36 +158,35 @@ def start_timer(subject_id):
     )
     
     db.session.add(new_session)
-    db.session.commit()
     
     # Update streak and grant points
     update_streak(current_user)
     update_user_points(current_user, 10)  # 10 points for starting a study session
+    db.session.commit()  # session, streak, points and badges land together
     
-    return redirect(url_for('subject_detail', subject_id=subject_id))
+    return action_done('subject_detail', {'running': True}, subject_id=subject_id)
 
 @app.route('/stop_timer/<int:subject_id>', methods=['POST'])
 @login_required
 def stop_timer(subject_id):
-    running_session = StudySession.query.filter_by(
+    running_id = db.session.scalar(select(StudySession.id).filter_by(
         user_id=current_user.id,
         subject_id=subject_id,
         end_time=None
-    ).first()
+    ).limit(1))
     
-    if running_session:
-        running_session.end_time = datetime.utcnow()
-        running_session.duration_minutes = int((running_session.end_time - running_session.start_time).total_seconds() / 60)
-        db.session.commit()
-        
+    # Closed with a single UPDATE; no StudySession object is loaded
+    duration = finish_session(current_user, running_id) if running_id else None
+    if duration is not None:
         # Award additional points based on study time
-        points = min(int(running_session.duration_minutes / 10) * 10, 50)  # Max 50 points
+        points = min(int(duration / 10) * 10, 50)  # Max 50 points
         update_user_points(current_user, points)
         
         # Check for achievements
         check_achievements(current_user)
+        db.session.commit()
     
-    return redirect(url_for('subject_detail', subject_id=subject_id))
+    return action_done('subject_detail', {'running': False}, subject_id=subject_id)
 
 # ---------------- Share Routes ----------------
 
@@ -148,30 +198,78 @@ def generate_share(subject_id):
     if subject.user_id != current_user.id:
         return 'Unauthorized', 403
     
-    if not subject.share_token:
-        subject.share_token = str(uuid.uuid4())
+    share_token = stored_share_token(subject.share_token)
+    if not share_token:
+        share_token = subject.share_token = new_share_token()
         db.session.commit()
     
-    return f"Share link: {request.url_root}share/{subject.share_token}"
+    return f"Share link: {request.url_root}share/{share_url_token(share_token)}"
+
+# Rendered share pages and PDFs, keyed by (kind, share_token). Public and read-only, so
+# repeat hits skip the queries and WeasyPrint; routes that edit a subject drop its entries.
+_share_cache = TTLCache(maxsize=256, ttl=600)
+_share_lock = threading.Lock()
+
+def cached_share(kind, share_token):
+    with _share_lock:
+        return _share_cache.get((kind, share_token))
+
+def store_share(kind, share_token, value):
+    with _share_lock:
+        _share_cache[(kind, share_token)] = value
+    return value
+
+def forget_share(subject):
+    share_token = stored_share_token(subject.share_token)
+    if share_token:
+        with _share_lock:
+            _share_cache.pop(('html', share_token), None)
+            _share_cache.pop(('pdf', share_token), None)
 
 @app.route('/share/<token>')
 def share_view(token):
-    subject = Subject.query.filter_by(share_token=token).first_or_404()
-    stats = subject_stats(subject.user_id)
-    return render_template('share.html', subject=subject, stats=stats, theme_css=theme_css('light'))
+    share_token = parse_share_url_token(token)
+    if share_token is None:
+        abort(404)
+    # The page also shows the owner's stats across all their subjects, which change without
+    # touching this one; user_stats is kept fresh by forget_stats, so reuse the page only while it matches
+    cached = cached_share('html', share_token)
+    if cached is not None and cached[1] == user_stats(cached[0]):
+        return cached[2]
+    subject = Subject.query.filter_by(share_token=share_token).first_or_404()
+    stats = user_stats(subject.user_id)
+    html_string = render_template('share.html', subject=subject, stats=stats, theme_css=theme_css('light'))
+    store_share('html', share_token, (subject.user_id, stats, html_string))
+    return html_string
+
+@lru_cache(maxsize=1)
+def pdf_renderer():
+    """WeasyPrint's HTML class and a shared FontConfiguration, set up once per process"""
+    # Imported here rather than at the top so the rest of the app runs without WeasyPrint's native libraries
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+    return HTML, FontConfiguration()
 
 @app.route('/share_pdf/<token>')
 def share_pdf(token):
-    from weasyprint import HTML
-    subject = Subject.query.filter_by(share_token=token).first_or_404()
-    stats = subject_stats(subject.user_id)
-    
-    html_string = render_template('share.html', subject=subject, stats=stats, theme_css=theme_css('light'))
-    pdf = HTML(string=html_string).write_pdf()
+    share_token = parse_share_url_token(token)
+    if share_token is None:
+        abort(404)
+    cached = cached_share('pdf', share_token)
+    if cached is None:
+        subject = Subject.query.options(
+            selectinload(Subject.chapters).selectinload(Chapter.topics)
+        ).filter_by(share_token=share_token).first_or_404()
+        
+        # Print-only template: inline layout CSS, no theme stylesheets for WeasyPrint to parse
+        html_string = render_template('share_pdf.html', subject=subject)
+        HTML, font_config = pdf_renderer()
+        cached = store_share('pdf', share_token, (subject.name, HTML(string=html_string).write_pdf(font_config=font_config)))
+    name, pdf = cached
     
     response = make_response(pdf)
     response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename={subject.name}_study_plan.pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename={name}_study_plan.pdf'
     return response
 
 # ---------------- Subject Routes ----------------
@@ -180,20 +278,20 @@ def share_pdf(token):
 @login_required
 def subject_detail(subject_id):
     # Use eager loading to prevent N+1 queries
-    from sqlalchemy.orm import joinedload
     subject = Subject.query.options(
-        joinedload(Subject.chapters).joinedload(Chapter.topics)
+        selectinload(Subject.chapters).selectinload(Chapter.topics),
+        selectinload(Subject.chapters).selectinload(Chapter.questions)
     ).get_or_404(subject_id)
     
     if subject.user_id != current_user.id:
         return 'Unauthorized', 403
     
-    # Check if there's a running session
-    running_session = StudySession.query.filter_by(
+    # Check if there's a running session (the template only needs a flag)
+    running_session = db.session.query(StudySession.query.filter_by(
         user_id=current_user.id,
         subject_id=subject_id,
         end_time=None
-    ).first()
+    ).exists()).scalar()
     
     if request.method == 'POST':
         action = request.form.get('action')
@@ -203,24 +301,25 @@ def subject_detail(subject_id):
             if chapter_name:
                 new_chapter = Chapter(name=chapter_name, subject_id=subject_id)
                 db.session.add(new_chapter)
-                db.session.commit()
                 
                 # Award points for adding content
                 update_user_points(current_user, 5)
+                db.session.commit()
+                forget_share(subject)
+                forget_stats(current_user.id)
         
         elif action == 'update_progress':
             topic_id = request.form.get('topic_id')
             status = request.form.get('status')
             progress = request.form.get('progress', 0)
             
-            topic = Topic.query.get_or_404(topic_id)
+            topic = get_topic_owned(topic_id, current_user.id)
             topic.status = status
             topic.progress = int(progress)
+            refresh_chapter_progress(topic.chapter_id)
             
             # Update chapter last studied
-            chapter = Chapter.query.get(topic.chapter_id)
-            if chapter:
-                chapter.last_studied = datetime.utcnow()
+            topic.chapter.last_studied = datetime.utcnow()
             
             # Award points for progress
             if status == 'completed':
@@ -229,11 +328,14 @@ def subject_detail(subject_id):
                 check_achievements(current_user)
             
             db.session.commit()
+            forget_share(topic.chapter.subject)
+            forget_stats(current_user.id)
         
         return redirect(url_for('subject_detail', subject_id=subject_id))
     
-    chapters = Chapter.query.filter_by(subject_id=subject_id).all()
-    revision_tips = [revision_tip(chapter) for chapter in chapters]
+    chapters = subject.chapters  # already selectin-loaded above
+    now = datetime.utcnow()
+    revision_tips = [revision_tip(chapter, now) for chapter in chapters]
     
     # Get due flashcards
     due_flashcards = get_due_flashcards(current_user)
@@ -249,35 +351,33 @@ def subject_detail(subject_id):
 @app.route('/chapter/<int:chapter_id>/add_topic', methods=['POST'])
 @login_required
 def add_topic(chapter_id):
-    chapter = Chapter.query.get_or_404(chapter_id)
-    subject = Subject.query.get(chapter.subject_id)
-    
-    if subject.user_id != current_user.id:
-        return 'Unauthorized', 403
+    chapter = get_chapter_owned(chapter_id, current_user.id)
+    subject = chapter.subject
     
     topic_name = request.form['topic_name']
     if topic_name:
-        new_topic = Topic(name=topic_name, chapter_id=chapter_id)
+        new_topic = Topic(name=topic_name, chapter_id=chapter_id, user_id=current_user.id)
         db.session.add(new_topic)
-        db.session.commit()
+        refresh_chapter_progress(chapter_id)
         
         # Award points
         update_user_points(current_user, 5)
+        db.session.commit()
+        forget_share(subject)
+        forget_stats(current_user.id)
     
-    return redirect(url_for('subject_detail', subject_id=subject.id))
+    return action_done('subject_detail', subject_id=subject.id)
 
 @app.route('/topic/<int:topic_id>/update', methods=['POST'])
 @login_required
 def update_topic(topic_id):
-    topic = Topic.query.get_or_404(topic_id)
-    chapter = Chapter.query.get(topic.chapter_id)
-    subject = Subject.query.get(chapter.subject_id)
-    
-    if subject.user_id != current_user.id:
-        return 'Unauthorized', 403
+    topic = get_topic_owned(topic_id, current_user.id)
+    chapter = topic.chapter
+    subject = chapter.subject
     
     topic.status = request.form.get('status', topic.status)
     topic.progress = int(request.form.get('progress', topic.progress))
+    refresh_chapter_progress(chapter.id)
     
     if topic.status == 'completed':
         chapter.last_studied = datetime.utcnow()
@@ -286,21 +386,20 @@ def update_topic(topic_id):
         check_achievements(current_user)
     
     db.session.commit()
-    return redirect(url_for('subject_detail', subject_id=subject.id))
+    forget_share(subject)
+    forget_stats(current_user.id)
+    return action_done('subject_detail', {'progress_pct': chapter.progress_pct}, subject_id=subject.id)
 
 @app.route('/topic/<int:topic_id>/notes', methods=['GET', 'POST'])
 @login_required
 def topic_notes(topic_id):
-    topic = Topic.query.get_or_404(topic_id)
-    chapter = Chapter.query.get(topic.chapter_id)
-    subject = Subject.query.get(chapter.subject_id)
-    
-    if subject.user_id != current_user.id:
-        return 'Unauthorized', 403
+    topic = get_topic_owned(topic_id, current_user.id, undefer(Topic.notes))
+    subject = topic.chapter.subject
     
     if request.method == 'POST':
         topic.notes = request.form.get('notes', '')
         db.session.commit()
+        forget_share(subject)
         return redirect(url_for('subject_detail', subject_id=subject.id))
     
     return render_template('topic_notes.html', topic=topic, subject=subject, theme_css=theme_css(current_user.theme))
@@ -308,12 +407,8 @@ def topic_notes(topic_id):
 @app.route('/topic/<int:topic_id>/flashcards', methods=['GET', 'POST'])
 @login_required
 def topic_flashcards(topic_id):
-    topic = Topic.query.get_or_404(topic_id)
-    chapter = Chapter.query.get(topic.chapter_id)
-    subject = Subject.query.get(chapter.subject_id)
-    
-    if subject.user_id != current_user.id:
-        return 'Unauthorized', 403
+    topic = get_topic_owned(topic_id, current_user.id)
+    subject = topic.chapter.subject
     
     if request.method == 'POST':
         action = request.form.get('action')
@@ -324,40 +419,39 @@ def topic_flashcards(topic_id):
             if front and back:
                 new_flashcard = Flashcard(
                     topic_id=topic_id,
+                    user_id=current_user.id,
                     front=front,
                     back=back,
                     next_review=datetime.utcnow()
                 )
                 db.session.add(new_flashcard)
-                db.session.commit()
                 
                 # Award points for creating flashcards
                 update_user_points(current_user, 3)
+                db.session.commit()
         
         elif action == 'review_flashcard':
             flashcard_id = request.form.get('flashcard_id')
             correct = request.form.get('correct') == 'true'
             
-            flashcard = Flashcard.query.get_or_404(flashcard_id)
+            flashcard = Flashcard.query.filter_by(id=flashcard_id, topic_id=topic_id).first_or_404()
             update_flashcard_mastery(flashcard, correct)
             
             # Award points for reviewing
             update_user_points(current_user, 2 if correct else 1)
             check_achievements(current_user)
+            db.session.commit()
         
         return redirect(url_for('topic_flashcards', topic_id=topic_id))
     
-    flashcards = Flashcard.query.filter_by(topic_id=topic_id).all()
+    flashcards = Flashcard.query.options(undefer(Flashcard.back)).filter_by(topic_id=topic_id).all()
     return render_template('topic_flashcards.html', topic=topic, subject=subject, flashcards=flashcards, theme_css=theme_css(current_user.theme))
 
 @app.route('/chapter/<int:chapter_id>/add_question', methods=['POST'])
 @login_required
 def add_question(chapter_id):
-    chapter = Chapter.query.get_or_404(chapter_id)
-    subject = Subject.query.get(chapter.subject_id)
-    
-    if subject.user_id != current_user.id:
-        return 'Unauthorized', 403
+    chapter = get_chapter_owned(chapter_id, current_user.id)
+    subject = chapter.subject
     
     question_text = request.form.get('question_text')
     difficulty = request.form.get('difficulty', 'medium')
@@ -369,12 +463,13 @@ def add_question(chapter_id):
             difficulty=difficulty
         )
         db.session.add(new_question)
-        db.session.commit()
         
         # Award points
         update_user_points(current_user, 2)
+        db.session.commit()
+        forget_share(subject)
     
-    return redirect(url_for('subject_detail', subject_id=subject.id))
+    return action_done('subject_detail', subject_id=subject.id)
 
 # ---------------- Dashboard Routes ----------------
 
@@ -391,17 +486,18 @@ def add_subject():
             color=color
         )
         db.session.add(new_subject)
-        db.session.commit()
         
         # Award points for adding a subject
         update_user_points(current_user, 10)
+        db.session.commit()
+        forget_stats(current_user.id)
     
     return redirect(url_for('home'))
 
 @app.route('/')
 @login_required
 def home():
-    stats = subject_stats(current_user.id)
+    stats = user_stats(current_user.id)
     achievements = get_user_achievements(current_user)
     
     # Get upcoming reminders
@@ -439,7 +535,7 @@ def achievements():
 @app.route('/leaderboard')
 @login_required
 def leaderboard():
-    users = User.query.order_by(User.points.desc()).limit(10).all()
+    users = leaderboard_snapshot()
     return render_template('leaderboard.html', users=users, theme_css=theme_css(current_user.theme))
 
 # ---------------- Reminder Routes ----------------
@@ -466,10 +562,10 @@ def reminders():
                 repeat=repeat
             )
             db.session.add(new_reminder)
-            db.session.commit()
             
             # Award points
             update_user_points(current_user, 5)
+            db.session.commit()
         
         elif action == 'complete_reminder':
             reminder_id = request.form.get('reminder_id')
@@ -481,15 +577,8 @@ def reminders():
             reminder.is_completed = True
             
             # If recurring, create next reminder
-            if reminder.repeat != 'once':
-                next_time = reminder.reminder_time
-                if reminder.repeat == 'daily':
-                    next_time += timedelta(days=1)
-                elif reminder.repeat == 'weekly':
-                    next_time += timedelta(weeks=1)
-                elif reminder.repeat == 'monthly':
-                    next_time += timedelta(days=30)
-                
+            next_time = next_occurrence(reminder.reminder_time, reminder.repeat)
+            if next_time:
                 new_reminder = Reminder(
                     user_id=current_user.id,
                     subject_id=reminder.subject_id,
@@ -500,13 +589,13 @@ def reminders():
                 )
                 db.session.add(new_reminder)
             
-            db.session.commit()
             update_user_points(current_user, 10)
+            db.session.commit()
         
         return redirect(url_for('reminders'))
     
     reminders = Reminder.query.filter_by(user_id=current_user.id).order_by(Reminder.reminder_time).all()
-    subjects = Subject.query.filter_by(user_id=current_user.id).all()
+    subjects = Subject.query.options(load_only(Subject.name, Subject.color)).filter_by(user_id=current_user.id).all()
     
     return render_template('reminders.html', reminders=reminders, subjects=subjects, theme_css=theme_css(current_user.theme))
 
@@ -551,10 +640,10 @@ def calendar():
                 event_type=event_type
             )
             db.session.add(new_event)
-            db.session.commit()
             
             # Award points
             update_user_points(current_user, 5)
+            db.session.commit()
         
         elif action == 'delete_event':
             event_id = request.form.get('event_id')
@@ -581,7 +670,7 @@ def calendar():
         StudyEvent.event_date <= end_of_month
     ).order_by(StudyEvent.event_date, StudyEvent.start_time).all()
     
-    subjects = Subject.query.filter_by(user_id=current_user.id).all()
+    subjects = Subject.query.options(load_only(Subject.name, Subject.color)).filter_by(user_id=current_user.id).all()
     
     return render_template('calendar.html', events=events, subjects=subjects, theme_css=theme_css(current_user.theme))
 
@@ -591,30 +680,32 @@ def calendar():
 @login_required
 def statistics():
     # Get detailed statistics
-    stats = subject_stats(current_user.id)
+    stats = user_stats(current_user.id)
     achievements = get_user_achievements(current_user)
     
     # Study time by day for the last 30 days
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    daily_study_time = {}
-    
-    sessions = StudySession.query.filter_by(user_id=current_user.id).filter(
-        StudySession.start_time >= thirty_days_ago
-    ).all()
-    
-    for session in sessions:
-        date = session.start_time.date()
-        daily_study_time[date] = daily_study_time.get(date, 0) + session.duration_minutes
+    day = func.date(StudySession.start_time, type_=db.Date)
+    daily_study_time = dict(db.session.execute(
+        select(day, func.sum(StudySession.duration_minutes))
+        .where(StudySession.user_id == current_user.id, StudySession.start_time >= thirty_days_ago)
+        .group_by(day)
+    ).all())
     
     # Subject-wise study time
-    subject_study_time = {}
-    for subject in current_user.subjects:
-        total_time = sum(s.duration_minutes for s in subject.study_sessions)
-        subject_study_time[subject.name] = total_time
+    subject_study_time = dict(db.session.execute(
+        select(Subject.name, func.coalesce(func.sum(StudySession.duration_minutes), 0))
+        .outerjoin(StudySession, StudySession.subject_id == Subject.id)
+        .where(Subject.user_id == current_user.id)
+        .group_by(Subject.id, Subject.name)
+        .order_by(Subject.id)
+    ).all())
     
     # Topic completion rate
-    total_topics = sum(len(ch.topics) for ch in Chapter.query.join(Subject).filter_by(user_id=current_user.id).all())
-    completed_topics = Topic.query.filter_by(status='completed').join(Chapter).join(Subject).filter_by(user_id=current_user.id).count()
+    total_topics, completed_topics = db.session.execute(
+        select(func.count(Topic.id), func.coalesce(func.sum(case((Topic.status == 'completed', 1), else_=0)), 0))
+        .where(Topic.user_id == current_user.id)
+    ).one()
     completion_rate = (completed_topics / total_topics * 100) if total_topics > 0 else 0
     
     # Flashcard mastery distribution
@@ -625,16 +716,20 @@ def statistics():
         'master': 0
     }
     
-    flashcards = Flashcard.query.join(Topic).join(Chapter).join(Subject).filter_by(user_id=current_user.id).all()
-    for fc in flashcards:
-        if fc.mastery_level <= 1:
-            flashcard_mastery['beginner'] += 1
-        elif fc.mastery_level <= 3:
-            flashcard_mastery['intermediate'] += 1
-        elif fc.mastery_level <= 4:
-            flashcard_mastery['advanced'] += 1
-        else:
-            flashcard_mastery['master'] += 1
+    # Bucket and count in SQL rather than loading every card
+    bucket = case(
+        (Flashcard.mastery_level <= 1, 'beginner'),
+        (Flashcard.mastery_level <= 3, 'intermediate'),
+        (Flashcard.mastery_level <= 4, 'advanced'),
+        else_='master'
+    )
+    rows = db.session.execute(
+        select(bucket, func.count(Flashcard.id))
+        .where(Flashcard.user_id == current_user.id)
+        .group_by(bucket)
+    )
+    for name, count in rows:
+        flashcard_mastery[name] = count
     
     return render_template('statistics.html',
                          stats=stats,
@@ -650,11 +745,23 @@ def statistics():
 @app.route('/export')
 @login_required
 def export_data():
-    data = export_user_data(current_user)
-    response = make_response(data)
-    response.headers['Content-Type'] = 'application/json'
-    response.headers['Content-Disposition'] = 'attachment; filename=study_planner_export.json'
-    return response
+    return Response(
+        stream_with_context(export_user_data(current_user)),
+        mimetype='application/json',
+        headers={'Content-Disposition': 'attachment; filename=study_planner_export.json'}
+    )
+
+def insert_returning_ids(model, rows):
+    """Bulk-insert rows and return their new ids in the same order"""
+    if not rows:
+        return []
+    return list(db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows))
+
+def average_progress(topics_data):
+    """Chapter.progress_pct for imported topics, matching utils.refresh_chapter_progress"""
+    if not topics_data:
+        return 0
+    return round(sum(t.get('progress', 0) for t in topics_data) / len(topics_data))
 
 @app.route('/import', methods=['POST'])
 @login_required
@@ -669,60 +776,65 @@ def import_data():
     try:
         data = json.loads(file.read().decode('utf-8'))
         
-        # Import subjects and their content
-        for subject_data in data.get('subjects', []):
-            new_subject = Subject(
-                user_id=current_user.id,
-                name=subject_data['name'],
-                color=subject_data.get('color', '#3498db')
-            )
-            db.session.add(new_subject)
-            db.session.flush()  # Get the ID
-            
-            for chapter_data in subject_data.get('chapters', []):
-                new_chapter = Chapter(
-                    subject_id=new_subject.id,
-                    name=chapter_data['name']
-                )
-                db.session.add(new_chapter)
-                db.session.flush()
-                
-                for topic_data in chapter_data.get('topics', []):
-                    new_topic = Topic(
-                        chapter_id=new_chapter.id,
-                        name=topic_data['name'],
-                        status=topic_data.get('status', 'not_started'),
-                        progress=topic_data.get('progress', 0),
-                        notes=topic_data.get('notes', '')
-                    )
-                    db.session.add(new_topic)
-                    db.session.flush()
-                    
-                    for flashcard_data in topic_data.get('flashcards', []):
-                        new_flashcard = Flashcard(
-                            topic_id=new_topic.id,
-                            front=flashcard_data['front'],
-                            back=flashcard_data['back'],
-                            mastery_level=flashcard_data.get('mastery_level', 0),
-                            next_review=datetime.utcnow()
-                        )
-                        db.session.add(new_flashcard)
+        now = datetime.utcnow()
         
-        # Import reminders
-        for reminder_data in data.get('reminders', []):
-            new_reminder = Reminder(
-                user_id=current_user.id,
-                title=reminder_data['title'],
-                description=reminder_data.get('description', ''),
-                reminder_time=datetime.fromisoformat(reminder_data['reminder_time']),
-                repeat=reminder_data.get('repeat', 'once')
-            )
-            db.session.add(new_reminder)
+        # Import subjects and their content: one INSERT per table, parents first.
+        # RETURNING (in parameter order) hands back the ids the next level needs.
+        subjects_data = data.get('subjects', [])
+        subject_ids = insert_returning_ids(Subject, [{
+            'user_id': current_user.id,
+            'name': subject_data['name'],
+            'color': subject_data.get('color', '#3498db')
+        } for subject_data in subjects_data])
         
-        db.session.commit()
+        chapters = [(subject_id, chapter_data)
+                    for subject_id, subject_data in zip(subject_ids, subjects_data)
+                    for chapter_data in subject_data.get('chapters', [])]
+        chapter_ids = insert_returning_ids(Chapter, [{
+            'subject_id': subject_id,
+            'name': chapter_data['name'],
+            'progress_pct': average_progress(chapter_data.get('topics', []))
+        } for subject_id, chapter_data in chapters])
+        
+        topics = [(chapter_id, topic_data)
+                  for chapter_id, (_, chapter_data) in zip(chapter_ids, chapters)
+                  for topic_data in chapter_data.get('topics', [])]
+        topic_ids = insert_returning_ids(Topic, [{
+            'chapter_id': chapter_id,
+            'user_id': current_user.id,
+            'name': topic_data['name'],
+            'status': topic_data.get('status', 'not_started'),
+            'progress': topic_data.get('progress', 0),
+            'notes': topic_data.get('notes', '')
+        } for chapter_id, topic_data in topics])
+        
+        flashcard_rows = [{
+            'topic_id': topic_id,
+            'user_id': current_user.id,
+            'front': flashcard_data['front'],
+            'back': flashcard_data['back'],
+            'mastery_level': flashcard_data.get('mastery_level', 0),
+            'next_review': now
+        } for topic_id, (_, topic_data) in zip(topic_ids, topics)
+          for flashcard_data in topic_data.get('flashcards', [])]
+        if flashcard_rows:
+            db.session.execute(insert(Flashcard), flashcard_rows)
+        
+        # Import reminders
+        reminder_rows = [{
+            'user_id': current_user.id,
+            'title': reminder_data['title'],
+            'description': reminder_data.get('description', ''),
+            'reminder_time': datetime.fromisoformat(reminder_data['reminder_time']),
+            'repeat': reminder_data.get('repeat', 'once')
+        } for reminder_data in data.get('reminders', [])]
+        if reminder_rows:
+            db.session.execute(insert(Reminder), reminder_rows)
         
         # Award points for importing
         update_user_points(current_user, 50)
+        db.session.commit()
+        forget_stats(current_user.id)
         
         return redirect(url_for('home'))
     
@@ -730,9 +842,59 @@ def import_data():
         db.session.rollback()
         return f'Error importing data: {str(e)}', 400
 
-# Create all tables
-with app.app_context():
+# ---------------- Schema ----------------
+
+@app.cli.command('init-db')
+def init_db():
+    """Create tables and indexes; run once per deploy instead of on every start."""
     db.create_all()
+    added = add_missing_columns()
+    for table, column in added:
+        click.echo(f'Added column {table}.{column}')
+    rebuilt = rebuild_study_sessions()
+    if rebuilt:
+        click.echo('Rebuilt study_session with a computed duration_minutes')
+    if rebuilt or ('user', 'total_study_minutes') in added:
+        click.echo(f'Recomputed study totals for {backfill_study_totals()} users')
+    if ('topic', 'user_id') in added or ('flashcard', 'user_id') in added:
+        click.echo(f'Backfilled {backfill_owner_ids()} rows')
+    if ('chapter', 'progress_pct') in added:
+        click.echo(f'Recomputed progress for {backfill_chapter_progress()} chapters')
+    for name in ensure_indexes():
+        click.echo(f'Could not create index {name}', err=True)
+
+@app.cli.command('expire-streaks')
+def expire_streaks_command():
+    """Reset lapsed study streaks; meant to run nightly from a scheduler."""
+    click.echo(f'Reset {expire_streaks()} streaks')
+
+@app.cli.command('backfill-owners')
+def backfill_owners_command():
+    """Copy owners onto topics/flashcards that predate topic.user_id and flashcard.user_id."""
+    add_missing_columns()
+    click.echo(f'Backfilled {backfill_owner_ids()} rows')
+
+@app.cli.command('backfill-study-totals')
+def backfill_study_totals_command():
+    """Rebuild users' running study totals from their finished sessions."""
+    add_missing_columns()
+    click.echo(f'Recomputed study totals for {backfill_study_totals()} users')
+
+@app.cli.command('backfill-chapter-progress')
+def backfill_chapter_progress_command():
+    """Recompute every chapter's cached progress_pct from its topics."""
+    add_missing_columns()
+    click.echo(f'Recomputed progress for {backfill_chapter_progress()} chapters')
+
+if app.config['AUTO_CREATE_ALL']:
+    with app.app_context():
+        db.create_all()
+
+if app.config['PRELOAD_PDF']:
+    try:
+        pdf_renderer()  # the first PDF request no longer pays for the import and font setup
+    except (ImportError, OSError):
+        pass  # WeasyPrint or its libraries are missing; share_pdf retries and reports it on use
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -1,12 +1,78 @@
-from flask import session, redirect, url_for
-from functools import wraps
+from flask import current_app
+from bisect import bisect_right
+from functools import lru_cache
+from types import MappingProxyType
 from datetime import datetime, timedelta
-from models import db, User, StudySession, Topic, Flashcard, Achievement, Badge
+import calendar
+import json
+import secrets
+import threading
+import uuid
+from cachetools import TTLCache, cached
+from sqlalchemy import select, insert, update, func, case, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import selectinload, raiseload, load_only
+from models import db, User, Subject, Chapter, StudySession, Topic, Flashcard, Achievement, Badge, Reminder
+
+# Compact export JSON; datetimes are written as ISO 8601 strings
+def json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=datetime.isoformat)
+
+# Share tokens: random 63-bit integers in the database, base62 strings in URLs
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+def new_share_token():
+    return secrets.randbits(63) or 1
+
+def encode_share_token(token):
+    digits = []
+    while token:
+        token, r = divmod(token, 62)
+        digits.append(BASE62[r])
+    return ''.join(reversed(digits)) or BASE62[0]
+
+def decode_share_token(text):
+    """Return the integer token, or None if text is not a valid base62 token"""
+    if not text or len(text) > 11:
+        return None
+    token = 0
+    for ch in text:
+        i = BASE62.find(ch)
+        if i < 0:
+            return None
+        token = token * 62 + i
+    return token if 0 < token < 2 ** 63 else None
+
+# Databases created before the BigInteger column keep share_token as VARCHAR: integer tokens read back
+# as digit strings, and subjects shared before then still hold their original UUID string
+def stored_share_token(value):
+    """Normalize a Subject.share_token as loaded: digit strings become ints, legacy UUIDs stay strings"""
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+def share_url_token(token):
+    """The token as it appears in share URLs; legacy UUID tokens are used verbatim so old links keep working"""
+    return encode_share_token(token) if isinstance(token, int) else token
+
+def parse_share_url_token(text):
+    """Return the stored token a share URL names (int, or legacy UUID string), or None if it is malformed"""
+    token = decode_share_token(text)
+    if token is None:
+        try:
+            uuid.UUID(text)
+        except ValueError:
+            return None
+        token = text
+    return token
 
 # Theme helpers
+@lru_cache(maxsize=2)
 def theme_css(theme):
+    # Shared between requests, so hand out read-only views
     if theme == 'dark':
-        return {
+        return MappingProxyType({
             'body_bg': '#1f1f1f',
             'text': '#eaeaea',
             'card_bg': '#2a2a2a',
@@ -19,8 +85,8 @@ def theme_css(theme):
             'button_hover': '#229954',
             'danger_bg': '#e74c3c',
             'danger_hover': '#c0392b'
-        }
-    return {
+        })
+    return MappingProxyType({
         'body_bg': '#f5f5f5',
         'text': '#2c3e50',
         'card_bg': '#ffffff',
@@ -33,50 +99,51 @@ def theme_css(theme):
         'button_hover': '#229954',
         'danger_bg': '#e74c3c',
         'danger_hover': '#c0392b'
-    }
+    })
 
 # Stats & revision helpers
 def subject_stats(user_id):
-    from sqlalchemy.orm import joinedload
-    
     subjects = []
     total_progress = 0
     total_topics = 0
     completed_topics = 0
     total_study_time = 0
     
-    # Use eager loading to prevent N+1 queries
-    subjects_data = Subject.query.options(
-        joinedload(Subject.chapters).joinedload(Chapter.topics)
-    ).filter_by(user_id=user_id).all()
+    # One grouped row per subject; study minutes come from a correlated subquery so the
+    # session rows don't multiply against the topic join
+    study_minutes = select(
+        func.coalesce(func.sum(StudySession.duration_minutes), 0)
+    ).where(StudySession.subject_id == Subject.id).correlate(Subject).scalar_subquery()
+    rows = db.session.execute(
+        select(
+            Subject.id, Subject.name, Subject.color,
+            func.count(Topic.id),
+            func.coalesce(func.sum(case((Topic.status == 'completed', 1), else_=0)), 0),
+            study_minutes
+        )
+        .outerjoin(Chapter, Chapter.subject_id == Subject.id)
+        .outerjoin(Topic, Topic.chapter_id == Chapter.id)
+        .where(Subject.user_id == user_id)
+        .group_by(Subject.id)
+        .order_by(Subject.id)
+    )
     
-    for subject in subjects_data:
-        total_subject_topics = 0
-        completed_subject_topics = 0
-        
-        for chapter in subject.chapters:
-            topics = chapter.topics  # Already loaded due to eager loading
-            total_subject_topics += len(topics)
-            completed_subject_topics += sum(1 for t in topics if t.status == 'completed')
-        
+    for subject_id, name, color, total_subject_topics, completed_subject_topics, study_time in rows:
         total_topics += total_subject_topics
         completed_topics += completed_subject_topics
         
         progress = int((completed_subject_topics / total_subject_topics * 100)) if total_subject_topics > 0 else 0
         total_progress += progress
-        
-        # Calculate study time for this subject (already loaded)
-        study_time = sum(session.duration_minutes for session in subject.study_sessions if session.duration_minutes)
         total_study_time += study_time
         
         subjects.append({
-            'id': subject.id,
-            'name': subject.name,
+            'id': subject_id,
+            'name': name,
             'progress': progress,
             'total_topics': total_subject_topics,
             'completed_topics': completed_subject_topics,
             'study_time': study_time,
-            'color': subject.color
+            'color': color
         })
     
     return {
@@ -87,19 +154,76 @@ def subject_stats(user_id):
         'total_study_time': total_study_time
     }
 
-def revision_tip(chapter):
+# subject_stats results shared across requests; routes that change the counted rows drop the entry.
+# Callers treat the returned dict as read-only.
+_stats_cache = TTLCache(maxsize=10_000, ttl=60)
+_stats_lock = threading.Lock()
+
+def user_stats(user_id):
+    with _stats_lock:
+        stats = _stats_cache.get(user_id)
+    if stats is None:
+        stats = subject_stats(user_id)
+        with _stats_lock:
+            _stats_cache[user_id] = stats
+    return stats
+
+def forget_stats(user_id):
+    with _stats_lock:
+        _stats_cache.pop(user_id, None)
+
+def chapter_average_progress(chapter_id):
+    """Scalar subquery: rounded average topic progress for chapter_id (a value or a column)"""
+    return select(
+        func.cast(func.round(func.coalesce(func.avg(Topic.progress), 0)), db.Integer)
+    ).where(Topic.chapter_id == chapter_id).scalar_subquery()
+
+def refresh_chapter_progress(chapter_id):
+    """Recompute a chapter's cached progress_pct after one of its topics changed"""
+    db.session.execute(update(Chapter).where(Chapter.id == chapter_id)
+                       .values(progress_pct=chapter_average_progress(chapter_id)))
+
+def backfill_chapter_progress():
+    """Recompute progress_pct for every chapter in one UPDATE; returns chapters updated"""
+    result = db.session.execute(
+        update(Chapter)
+        .values(progress_pct=chapter_average_progress(Chapter.id))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+# Revision tips: REVISION_DAYS[i] is the first day count that gets REVISION_TIPS[i + 1]
+REVISION_DAYS = (3, 7, 14)
+REVISION_TIPS = (
+    "You just studied this! Review in a couple days.",
+    "Time for a quick review to reinforce learning.",
+    "Good time for a thorough revision session.",
+    "Urgent! This chapter needs your attention.",
+)
+
+def revision_tip(chapter, now=None):
     if not chapter.last_studied:
         return "Start studying this chapter today!"
     
-    days_since = (datetime.utcnow() - chapter.last_studied).days
-    if days_since < 3:
-        return "You just studied this! Review in a couple days."
-    elif days_since < 7:
-        return "Time for a quick review to reinforce learning."
-    elif days_since < 14:
-        return "Good time for a thorough revision session."
-    else:
-        return "Urgent! This chapter needs your attention."
+    days_since = ((now or datetime.utcnow()) - chapter.last_studied).days
+    return REVISION_TIPS[bisect_right(REVISION_DAYS, days_since)]
+
+# Reminder recurrence
+REPEAT_STEP = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+
+def add_months(when, months):
+    """Same day next month(s), clamped to the month's last day (Jan 31 -> Feb 28/29)"""
+    month_index = when.month - 1 + months
+    year, month = when.year + month_index // 12, month_index % 12 + 1
+    return when.replace(year=year, month=month, day=min(when.day, calendar.monthrange(year, month)[1]))
+
+def next_occurrence(when, repeat):
+    """Next reminder_time for a recurring reminder, or None if it does not repeat"""
+    if repeat == 'monthly':
+        return add_months(when, 1)
+    step = REPEAT_STEP.get(repeat)
+    return when + step if step else None
 
 # Gamification helpers
 def calculate_level(points):
@@ -116,12 +240,12 @@ def update_user_points(user, points_to_add):
         # User leveled up - grant a badge
         grant_badge(user, 'level_up', f'Reached Level {user.level}!')
     
-    db.session.commit()
     return user.level > old_level
 
 def update_streak(user):
     """Update and return user's study streak"""
-    today = datetime.utcnow().date()
+    now = datetime.utcnow()
+    today = now.date()
     
     if user.last_study_date:
         last_date = user.last_study_date.date()
@@ -139,124 +263,287 @@ def update_streak(user):
     else:
         user.streak = 1  # First study session
     
-    user.last_study_date = datetime.utcnow()
-    db.session.commit()
+    user.last_study_date = now  # same instant the streak was judged against
     return user.streak
 
-def grant_badge(user, badge_type, description):
-    """Grant a badge to a user"""
-    existing_badge = Badge.query.filter_by(
-        user_id=user.id,
-        name=badge_type
+def expire_streaks():
+    """Zero the streak of every user who missed yesterday; returns the number of users reset"""
+    # update_streak only runs when a user studies, so lapsed streaks would otherwise linger
+    yesterday = datetime.combine(datetime.utcnow().date() - timedelta(days=1), datetime.min.time())
+    result = db.session.execute(
+        update(User)
+        .where(User.streak > 0, User.last_study_date < yesterday)
+        .values(streak=0)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+# Columns added to tables that already exist in deployed databases; create_all() never alters a table
+ADDED_COLUMNS = (
+    ('user', 'total_study_minutes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('user', 'session_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('topic', 'user_id', 'INTEGER REFERENCES "user" (id) ON DELETE CASCADE'),
+    ('flashcard', 'user_id', 'INTEGER REFERENCES "user" (id) ON DELETE CASCADE'),
+    ('chapter', 'progress_pct', 'INTEGER DEFAULT 0'),
+)
+
+def add_missing_columns():
+    """ALTER in any ADDED_COLUMNS entry the database lacks; returns the (table, column) pairs added"""
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in existing:
+                continue  # create_all() builds it with every column
+            if column in {c['name'] for c in inspector.get_columns(table)}:
+                continue
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}')
+            added.append((table, column))
+    return added
+
+def rebuild_study_sessions():
+    """Recreate study_session if its duration_minutes predates the generated column; returns True if rebuilt"""
+    # SQLite can't ALTER a plain column into a generated one, so the rows are copied into a fresh table
+    table = StudySession.__table__
+    inspector = inspect(db.engine)
+    if table.name not in inspector.get_table_names():
+        return False
+    if any('computed' in c for c in inspector.get_columns(table.name) if c['name'] == 'duration_minutes'):
+        return False
+    columns = ', '.join(c.name for c in table.columns if c.computed is None)
+    with db.engine.begin() as conn:
+        # Index names outlive a RENAME, so drop them first; ones the model doesn't declare are put back after
+        extra = conn.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table.name,)).all()
+        for name, _ in extra:
+            conn.exec_driver_sql(f'DROP INDEX "{name}"')
+        conn.exec_driver_sql(f'ALTER TABLE {table.name} RENAME TO {table.name}_old')
+        table.create(conn)
+        conn.exec_driver_sql(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old')
+        conn.exec_driver_sql(f'DROP TABLE {table.name}_old')
+        declared = {index.name for index in table.indexes}
+        for name, sql in extra:
+            if name not in declared:
+                conn.exec_driver_sql(sql)
+    return True
+
+def ensure_indexes():
+    """Create any declared index the database lacks; returns the names that could not be built"""
+    # create_all() only indexes the tables it creates, so existing databases would miss new ones
+    failed = []
+    existing = set(inspect(db.engine).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue  # create_all() builds it together with its indexes
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except DBAPIError as e:
+                current_app.logger.warning('index %s not created: %s', index.name, e.orig)
+                failed.append(index.name)
+    return failed
+
+def backfill_owner_ids():
+    """Fill Topic/Flashcard.user_id for rows written before the column existed; returns rows updated"""
+    topics = db.session.execute(
+        update(Topic)
+        .where(Topic.user_id.is_(None))
+        .values(user_id=select(Subject.user_id).join(Chapter)
+                .where(Chapter.id == Topic.chapter_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    flashcards = db.session.execute(
+        update(Flashcard)
+        .where(Flashcard.user_id.is_(None))
+        .values(user_id=select(Topic.user_id)
+                .where(Topic.id == Flashcard.topic_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return topics.rowcount + flashcards.rowcount
+
+def backfill_study_totals():
+    """Recompute every user's total_study_minutes/session_count from finished sessions; returns users updated"""
+    finished = (StudySession.user_id == User.id, StudySession.end_time.isnot(None))
+    result = db.session.execute(
+        update(User)
+        .values(
+            total_study_minutes=select(func.coalesce(func.sum(StudySession.duration_minutes), 0))
+            .where(*finished).scalar_subquery(),
+            session_count=select(func.count(StudySession.id)).where(*finished).scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def finish_session(user, session_id):
+    """Close a running session and add it to the user's running totals; returns its minutes, or None if already closed"""
+    # duration_minutes is computed by the database from end_time, so read it back from the UPDATE itself
+    row = db.session.execute(
+        update(StudySession)
+        .where(StudySession.id == session_id, StudySession.end_time.is_(None))
+        .values(end_time=datetime.utcnow())
+        .returning(StudySession.start_time, StudySession.end_time, StudySession.duration_minutes)
+        .execution_options(synchronize_session=False)
     ).first()
-    
-    if not existing_badge:
-        badge_icons = {
-            'level_up': '🎖️',
-            'week_streak': '🔥',
-            'month_streak': '💎',
-            'first_topic': '⭐',
-            'topics_master': '🏆',
-            'flashcard_master': '🧠',
-            'study_warrior': '⚔️'
-        }
-        
-        badge = Badge(
-            user_id=user.id,
-            name=badge_type,
-            description=description,
-            icon=badge_icons.get(badge_type, '🏅')
+    if row is None:
+        return None
+    duration = row.duration_minutes
+    if duration is None:
+        # study_session not rebuilt by init-db yet, so duration_minutes is still a plain column
+        duration = int((row.end_time - row.start_time).total_seconds()) // 60
+        db.session.execute(
+            update(StudySession)
+            .where(StudySession.id == session_id)
+            .values(duration_minutes=duration)
+            .execution_options(synchronize_session=False)
         )
-        db.session.add(badge)
-        db.session.commit()
-        return True
-    return False
+    forget_stats(user.id)
+    # SQL-side increments so concurrent stops from the same user don't lose updates
+    user.total_study_minutes = User.total_study_minutes + duration
+    user.session_count = User.session_count + 1
+    db.session.flush()  # later helpers in the same request read the new totals
+    return duration
+
+BADGE_ICONS = {
+    'level_up': '🎖️',
+    'week_streak': '🔥',
+    'month_streak': '💎',
+    'first_topic': '⭐',
+    'topics_master': '🏆',
+    'flashcard_master': '🧠',
+    'study_warrior': '⚔️'
+}
+
+@lru_cache(maxsize=1)
+def badge_upsert():
+    # ON CONFLICT needs uq_badge_user_name, which init-db builds; checked once per process on first use
+    return (db.engine.dialect.name == 'sqlite' and 'uq_badge_user_name' in
+            {index['name'] for index in inspect(db.engine).get_indexes('badge')})
+
+def grant_badges(user, badges):
+    """Grant several (badge_type, description) badges at once, skipping ones the user already has"""
+    if not badges:
+        return []
+    rows = [{'user_id': user.id, 'name': name, 'description': description,
+             'icon': BADGE_ICONS.get(name, '🏅'), 'earned_at': datetime.utcnow()}
+            for name, description in badges]
+    if badge_upsert():
+        # One multi-row INSERT; uq_badge_user_name turns already-owned badges into no-ops,
+        # and RETURNING reports only the rows that went in
+        granted = set(db.session.scalars(
+            sqlite_insert(Badge)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=['user_id', 'name'])
+            .returning(Badge.name)
+        ))
+    else:
+        # Without the unique index ON CONFLICT has nothing to match; look up owned badges first
+        owned = set(db.session.scalars(
+            select(Badge.name).where(Badge.user_id == user.id, Badge.name.in_([row['name'] for row in rows]))
+        ))
+        new_rows = [row for row in rows if row['name'] not in owned]
+        if new_rows:
+            db.session.execute(insert(Badge), new_rows)
+        granted = {row['name'] for row in new_rows}
+    return [name for name, _ in badges if name in granted]
+
+def grant_badge(user, badge_type, description):
+    """Grant a badge to a user"""
+    return bool(grant_badges(user, [(badge_type, description)]))
+
+def capped_count(stmt, cap=None):
+    """COUNT(*) over stmt's rows as a scalar subquery, stopping once cap rows have been seen"""
+    if cap is not None:
+        stmt = stmt.limit(cap)
+    return select(func.count()).select_from(stmt.subquery()).scalar_subquery()
+
+def progress_counts(user_id, topic_cap=None, flashcard_cap=None):
+    """Return (completed topics, mastered flashcards) for a user in one round trip; caps bound each count"""
+    completed_topics = capped_count(
+        select(Topic.id).where(Topic.user_id == user_id, Topic.status == 'completed'), topic_cap)
+    mastered_flashcards = capped_count(
+        select(Flashcard.id).where(Flashcard.user_id == user_id, Flashcard.mastery_level >= 5), flashcard_cap)
+    return tuple(db.session.execute(select(completed_topics, mastered_flashcards)).one())
 
 def check_achievements(user):
     """Check and award achievements"""
     achievements = []
+    earned = []  # badges to grant, written together at the end
+    
+    # Only the badge thresholds matter here, so neither count needs to go past them
+    completed_topics, mastered_flashcards = progress_counts(user.id, topic_cap=100, flashcard_cap=50)
     
     # Check for first completed topic
-    completed_topics = Topic.query.filter_by(status='completed').join(
-        Chapter
-    ).join(
-        Subject
-    ).filter_by(user_id=user.id).count()
     
     if completed_topics == 1:
-        grant_badge(user, 'first_topic', 'Completed your first topic!')
+        earned.append(('first_topic', 'Completed your first topic!'))
         achievements.append('First Topic Completed')
     
     # Check for topics master (100 topics)
     if completed_topics >= 100:
-        grant_badge(user, 'topics_master', 'Completed 100 topics!')
+        earned.append(('topics_master', 'Completed 100 topics!'))
         achievements.append('Topics Master')
     
     # Check for flashcard mastery
-    mastered_flashcards = Flashcard.query.join(
-        Topic
-    ).join(
-        Chapter
-    ).join(
-        Subject
-    ).filter_by(user_id=user.id).filter(
-        Flashcard.mastery_level >= 5
-    ).count()
-    
     if mastered_flashcards >= 50:
-        grant_badge(user, 'flashcard_master', 'Mastered 50 flashcards!')
+        earned.append(('flashcard_master', 'Mastered 50 flashcards!'))
         achievements.append('Flashcard Master')
     
     # Check for study warrior (100 hours of study)
-    total_study_hours = sum(
-        session.duration_minutes for session in StudySession.query.filter_by(user_id=user.id).all()
-    ) / 60
+    total_study_hours = user.total_study_minutes / 60
     
     if total_study_hours >= 100:
-        grant_badge(user, 'study_warrior', 'Studied for 100 hours!')
+        earned.append(('study_warrior', 'Studied for 100 hours!'))
         achievements.append('Study Warrior')
     
+    grant_badges(user, earned)
     return achievements
 
 def get_user_achievements(user):
     """Get all user achievements and statistics"""
-    from sqlalchemy.orm import joinedload
+    completed_topics, mastered_flashcards = progress_counts(user.id)
     
     return {
         'points': user.points,
         'level': user.level,
         'streak': user.streak,
         'badges': Badge.query.filter_by(user_id=user.id).order_by(Badge.earned_at.desc()).all(),
-        'completed_topics': Topic.query.filter_by(status='completed').join(
-            Chapter
-        ).join(
-            Subject
-        ).filter_by(user_id=user.id).count(),
-        'mastered_flashcards': Flashcard.query.join(
-            Topic
-        ).join(
-            Chapter
-        ).join(
-            Subject
-        ).filter_by(user_id=user.id).filter(
-            Flashcard.mastery_level >= 5
-        ).count(),
-        'total_study_hours': sum(
-            session.duration_minutes for session in StudySession.query.filter_by(user_id=user.id).all()
-        ) / 60
+        'completed_topics': completed_topics,
+        'mastered_flashcards': mastered_flashcards,
+        'total_study_hours': user.total_study_minutes / 60
     }
 
+# Leaderboard is global and tolerates a few minutes of lag, so every user shares one snapshot.
+# Plain dicts (not ORM rows) so the cached copy is safe to hand to any request/thread.
+@cached(TTLCache(maxsize=1, ttl=300), lock=threading.Lock())
+def leaderboard_snapshot(limit=10):
+    users = User.query.options(selectinload(User.badges)).order_by(User.points.desc()).limit(limit).all()
+    return [{
+        'id': u.id,
+        'username': u.username,
+        'points': u.points,
+        'level': u.level,
+        'streak': u.streak,
+        'badges': [{'name': b.name, 'icon': b.icon, 'description': b.description} for b in u.badges]
+    } for u in users]
+
 # Spaced repetition algorithm for flashcards
-def calculate_next_review(mastery_level, review_count):
+REVIEW_INTERVALS = tuple(timedelta(days=days) for days in (1, 3, 7, 14, 30, 60))  # by mastery level (0-5)
+MAX_REVIEW_INTERVAL = timedelta(days=90)
+
+def calculate_next_review(mastery_level):
     """Calculate next review date using spaced repetition"""
-    intervals = [1, 3, 7, 14, 30, 60]  # Days based on mastery level (0-5)
-    
-    if mastery_level < len(intervals):
-        days = intervals[mastery_level]
+    if mastery_level < len(REVIEW_INTERVALS):
+        interval = REVIEW_INTERVALS[mastery_level]
     else:
-        days = 90  # Maximum interval
+        interval = MAX_REVIEW_INTERVAL
     
-    return datetime.utcnow() + timedelta(days=days)
+    return datetime.utcnow() + interval
 
 def update_flashcard_mastery(flashcard, correct):
     """Update flashcard mastery based on review result"""
@@ -267,95 +554,73 @@ def update_flashcard_mastery(flashcard, correct):
     else:
         flashcard.mastery_level = max(flashcard.mastery_level - 1, 0)
     
-    flashcard.next_review = calculate_next_review(
-        flashcard.mastery_level,
-        flashcard.review_count
-    )
+    flashcard.next_review = calculate_next_review(flashcard.mastery_level)
     
-    db.session.commit()
     return flashcard.mastery_level
 
-# Decorators
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
-
 # Data export/import helpers
 def export_user_data(user):
-    """Export user data as JSON"""
-    from json import dumps
-    data = {
-        'user': {
-            'username': user.username,
-            'theme': user.theme,
-            'points': user.points,
-            'streak': user.streak,
-            'level': user.level
-        },
-        'subjects': [],
-        'reminders': [],
-        'study_events': []
-    }
+    """Export user data as JSON, yielded piece by piece so the document is never held in memory whole"""
+    yield '{"user": ' + json_dumps({
+        'username': user.username,
+        'theme': user.theme,
+        'points': user.points,
+        'streak': user.streak,
+        'level': user.level
+    }) + ', "subjects": ['
     
-    for subject in user.subjects:
-        subject_data = {
+    # yield_per keeps one batch of subjects (with their selectin-loaded children) alive at a time
+    chapters = selectinload(Subject.chapters)
+    topics = chapters.selectinload(Chapter.topics)
+    flashcards = topics.selectinload(Topic.flashcards)
+    # Only the exported columns (load_only names notes/back, which also undefers them)
+    loads = [load_only(Subject.name, Subject.color), chapters.load_only(Chapter.name),
+             topics.load_only(Topic.name, Topic.status, Topic.progress, Topic.notes),
+             flashcards.load_only(Flashcard.front, Flashcard.back, Flashcard.mastery_level)]
+    if current_app.debug:
+        # an unplanned lazy load (N+1) raises while developing instead of quietly querying per row
+        loads += [raiseload('*', sql_only=True)]
+        loads += [strategy.raiseload('*', sql_only=True) for strategy in (chapters, topics, flashcards)]
+    subjects = Subject.query.options(*loads).filter_by(user_id=user.id).order_by(Subject.id).yield_per(100)
+    for i, subject in enumerate(subjects):
+        yield (', ' if i else '') + json_dumps({
             'name': subject.name,
             'color': subject.color,
-            'chapters': []
-        }
-        
-        for chapter in subject.chapters:
-            chapter_data = {
+            'chapters': [{
                 'name': chapter.name,
-                'topics': []
-            }
-            
-            for topic in chapter.topics:
-                topic_data = {
+                'topics': [{
                     'name': topic.name,
                     'status': topic.status,
                     'progress': topic.progress,
                     'notes': topic.notes,
-                    'flashcards': []
-                }
-                
-                for flashcard in topic.flashcards:
-                    topic_data['flashcards'].append({
+                    'flashcards': [{
                         'front': flashcard.front,
                         'back': flashcard.back,
                         'mastery_level': flashcard.mastery_level
-                    })
-                
-                chapter_data['topics'].append(topic_data)
-            
-            subject_data['chapters'].append(chapter_data)
-        
-        data['subjects'].append(subject_data)
+                    } for flashcard in topic.flashcards]
+                } for topic in chapter.topics]
+            } for chapter in subject.chapters]
+        })
     
-    for reminder in user.reminders:
-        data['reminders'].append({
+    yield '], "reminders": ['
+    reminders = Reminder.query.options(
+        load_only(Reminder.title, Reminder.description, Reminder.reminder_time, Reminder.repeat)
+    ).filter_by(user_id=user.id).order_by(Reminder.id).yield_per(500)
+    for i, reminder in enumerate(reminders):
+        yield (', ' if i else '') + json_dumps({
             'title': reminder.title,
             'description': reminder.description,
-            'reminder_time': reminder.reminder_time.isoformat(),
+            'reminder_time': reminder.reminder_time,
             'repeat': reminder.repeat
         })
-    
-    return dumps(data, indent=2)
+    yield '], "study_events": []}'
 
 def get_due_flashcards(user):
     """Get flashcards due for review"""
-    from models import Flashcard, Topic, Chapter, Subject
-    return Flashcard.query.join(
-        Topic
-    ).join(
-        Chapter
-    ).join(
-        Subject
+    # Due lists show the card front; back, review_count and user_id stay unloaded
+    return Flashcard.query.options(
+        load_only(Flashcard.topic_id, Flashcard.front, Flashcard.next_review, Flashcard.mastery_level)
     ).filter(
-        Subject.user_id == user.id,
+        Flashcard.user_id == user.id,
         Flashcard.next_review <= datetime.utcnow()
     ).all()
\ No newline at end of file